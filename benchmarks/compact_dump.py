@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Benchmark the compact binary dumps against the TSV reader.
+
+A synthetic EntrezGene dump is written to a temporary
+directory (or DIR, if given), then the rows are read
+  - as raw dump rows (_concept_rows),
+  - as RowBatches (what aggregation reads per resource),
+  - as output TSV (aggregation end-to-end),
+once from the TSV and once from the compact copy.
+
+Run from the repository root:
+    python3 -m benchmarks.compact_dump [-n ROWS] [DIR]
+'''
+
+
+import io
+import csv
+import time
+import random
+import argparse
+import tempfile
+import itertools as it
+
+from bth.core import settings
+from bth.inputfilters.entrezgene import RecordSet
+from bth.lib.tools import TSVDialect
+
+
+def main():
+    '''
+    Run as script.
+    '''
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument(
+        'directory', nargs='?', metavar='DIR',
+        help='directory for the synthetic dump (default: temporary)')
+    ap.add_argument(
+        '-n', '--rows', type=int, default=2000000, metavar='N',
+        help='number of concepts in the dump (default: %(default)s)')
+    args = ap.parse_args()
+    if args.directory is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            run(tmpdir, args.rows)
+    else:
+        run(args.directory, args.rows)
+
+
+def run(directory, n):
+    '''
+    Generate a dump and compare the readers.
+    '''
+    settings.path_dumps = directory
+    generate(RecordSet.dump_fns()[0], n)
+    timings = {}
+    for label in ('tsv', 'compact'):
+        if label == 'compact':
+            start = time.time()
+            RecordSet.compile_dumps()
+            print('compile: {:.2f} s'.format(time.time()-start))
+        for step, func in STEPS:
+            start = time.time()
+            count = func()
+            timings[label, step] = elapsed = time.time() - start
+            print('{:8} {:12} {:>10} rows {:7.2f} s'
+                  .format(label, step, count, elapsed))
+    for step, _ in STEPS:
+        print('speedup {:12} {:.2f}x'
+              .format(step, timings['tsv', step]/timings['compact', step]))
+
+
+def generate(path, n):
+    '''
+    Write n concepts in the canonical _iter_concepts format.
+    '''
+    rnd = random.Random(0)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            symbol = 'GENE{}'.format(rnd.randrange(n))
+            synonyms = ['{}-{}'.format(symbol, j)
+                        for j in range(rnd.choice((0, 0, 1, 2, 4)))]
+            f.write('\t'.join([str(i), symbol, symbol, *synonyms]) + '\n')
+
+
+def _raw_rows():
+    return sum(1 for _ in RecordSet()._concept_rows())
+
+
+def _batches():
+    return sum(len(b) for b in RecordSet().iter_batches())
+
+
+def _output():
+    # Like RecordSetContainer.write_tsv, but discarding the output.
+    f = io.TextIOWrapper(_NullWriter(), encoding='utf-8', newline='')
+    writer = csv.writer(f, dialect=TSVDialect)
+    n = 0
+    for batch in RecordSet().iter_batches():
+        writer.writerows(batch.tuples())
+        n += len(batch)
+    f.flush()
+    return n
+
+
+class _NullWriter(io.RawIOBase):
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return len(b)
+
+
+STEPS = [
+    ('dump rows', _raw_rows),
+    ('batches', _batches),
+    ('output', _output),
+]
+
+
+if __name__ == '__main__':
+    main()
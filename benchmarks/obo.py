@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Benchmark OBO parsing on a synthetic PRO-like ontology.
+
+An .obo file is generated (unless FILE exists already),
+then it is parsed with pro.RecordSet: iter_stanzas in
+the main process, and preprocess with a single worker
+and with -j workers (comparing the outputs).
+
+Run from the repository root:
+    python3 -m benchmarks.obo [-n STANZAS] [-j N] FILE
+'''
+
+
+import os
+import time
+import random
+import hashlib
+import argparse
+import resource
+
+from bth.core import settings
+from bth.inputfilters.pro import RecordSet
+
+
+def main():
+    '''
+    Run as script.
+    '''
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument(
+        'path', metavar='FILE',
+        help='synthetic .obo file, created if missing')
+    ap.add_argument(
+        '-n', '--stanzas', type=int, default=2000000, metavar='N',
+        help='number of [Term] stanzas to generate (default: %(default)s)')
+    ap.add_argument(
+        '-j', '--jobs', type=int, default=settings.preprocess_workers,
+        metavar='N',
+        help='number of worker processes (default: %(default)s)')
+    args = ap.parse_args()
+    if not os.path.exists(args.path):
+        start = time.time()
+        generate(args.path, args.stanzas)
+        print('generated in {:.1f} s'.format(time.time()-start))
+
+    start = time.time()
+    with open(args.path, encoding='utf-8') as f:
+        n = sum(1 for _ in RecordSet.iter_stanzas(f))
+    print('iter_stanzas: {} concepts, {:.2f} s'.format(n, time.time()-start))
+
+    digests = set()
+    for workers in sorted({1, args.jobs}):
+        digest, wall, cpu_main, cpu_workers = run(args.path, workers)
+        digests.add(digest)
+        print('preprocess, {:2d} worker(s): {:7.2f} s wall, CPU: {:7.2f} s '
+              'main, {:7.2f} s workers'
+              .format(workers, wall, cpu_main, cpu_workers))
+    assert len(digests) == 1, 'outputs differ'
+
+
+def run(path, workers):
+    '''
+    Preprocess the file and return the output hash and times.
+    '''
+    settings.preprocess_workers = workers
+    before = _cpu_times()
+    start = time.time()
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for line in RecordSet.preprocess(f):
+            digest.update(line)
+    wall = time.time() - start
+    after = _cpu_times()
+    return (digest.hexdigest(), wall, *(b-a for a, b in zip(before, after)))
+
+
+def _cpu_times():
+    return tuple(r.ru_utime + r.ru_stime
+                 for r in (resource.getrusage(resource.RUSAGE_SELF),
+                           resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+HEADER = '''\
+format-version: 1.2
+data-version: 59.0
+ontology: pr
+
+'''
+
+TERM = '''\
+[Term]
+id: PR:{id:09d}
+name: protein {id}
+def: "A protein that is a translation product of some gene {id}." [PRO:DNx]
+{comment}{synonyms}\
+xref: UniProtKB:P{xref:05d}
+is_a: PR:{parent:09d} ! parent
+relationship: only_in_taxon NCBITaxon:9606 ! Homo sapiens
+{obsolete}
+'''
+
+SYNONYM = 'synonym: "p{} \\"alt\\" {}" {} [UniProtKB:Q{:05d}]\n'
+
+TYPEDEF = '''\
+[Typedef]
+id: only_in_taxon
+name: only in taxon
+'''
+
+
+def generate(path, n):
+    '''
+    Write n [Term] stanzas resembling PRO.
+
+    Most lines have tags that are irrelevant for the Hub;
+    synonyms include escaped quotes and different scopes.
+    '''
+    rnd = random.Random(0)
+    scopes = ('EXACT', 'RELATED', 'EXACT PRO-short-label')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for i in range(n):
+            f.write(TERM.format(
+                id=i,
+                comment='comment: Category=gene.\n' if i % 3 == 0 else '',
+                synonyms=''.join(SYNONYM.format(i, j, rnd.choice(scopes), j)
+                                 for j in range(i % 4)),
+                xref=i % 99999,
+                parent=i // 2,
+                obsolete='is_obsolete: true\n' if i % 50 == 0 else ''))
+        f.write(TYPEDEF)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Benchmark the cross-lookup PairHashSet against a set of tuples.
+
+Each variant runs in a fresh process, which collects
+synthetic MeSH-like (ID, term) pairs, makes a frozenset
+copy (like the former ctd.RecordSet(exclude=...)), and
+then looks up as many pairs (half of them hits).
+Memory is the increase of the peak RSS.
+
+Run from the repository root:
+    python3 -m benchmarks.pairhash_set [-n PAIRS]
+'''
+
+
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+from bth.lib.pairhash import PairHashSet
+
+
+def main():
+    '''
+    Run as script.
+    '''
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument(
+        '-n', '--pairs', type=int, default=5000000, metavar='N',
+        help='number of ID/term pairs (default: %(default)s)')
+    args = ap.parse_args()
+    ctx = mp.get_context('spawn')
+    for variant in ('set', 'PairHashSet'):
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run, (variant, args.pairs))
+        print('{:12} build {:6.2f} s  lookup {:6.2f} s  '
+              '({:.1f} M lookups/s)  memory {:5d} MB'.format(variant, *result))
+
+
+def run(variant, n):
+    '''
+    Time one variant in the current process.
+    '''
+    rss = _maxrss()
+    start = time.time()
+    if variant == 'set':
+        lookup = frozenset(set(_pairs(n)))
+    else:
+        lookup = PairHashSet(_pairs(n))
+        len(lookup)  # consolidate
+    build = time.time() - start
+    memory = _maxrss() - rss
+
+    start = time.time()
+    hits = sum(pair in lookup for pair in _pairs(n, offset=n//2))
+    search = time.time() - start
+    assert hits == n - n//2
+    return build, search, n/search/1e6, memory
+
+
+def _pairs(n, offset=0):
+    for i in range(offset, offset+n):
+        yield ('D{:06d}'.format(i//3),
+               'synonym {} of concept {}'.format(i%3, i//3))
+
+
+def _maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Benchmark postfiltering row by row against RowBatch chunks.
+
+A synthetic stream of rows is passed through a list of
+postfilters wrapped with combine(), once row by row
+(calling the wrapper on the rows) and once in chunks
+(its `chunked` attribute, as used in aggregation).
+To keep the memory bounded, the stream cycles through
+a fixed set of distinct batches.
+
+Run from the repository root:
+    python3 -m benchmarks.postfilters [-n ROWS]
+'''
+
+
+import time
+import random
+import argparse
+import itertools as it
+
+from bth.lib import postfilters
+from bth.lib.tools import RowBatch, iter_chunks
+
+
+BATCH_SIZE = 10000
+DISTINCT_BATCHES = 100
+
+RESOURCES = ('EntrezGene', 'CTD (MESH)', 'MeSH desc (Diseases)', 'Swiss-Prot')
+WORDS = ('the', 'Parkinson disease', 'ab', 'kinase', 'x1', 'cell',
+         'alpha-2 receptor', 'Lyme disease', 'CAMP')
+
+CHAINS = {
+    'filters': [
+        {'class': 'RegexFilter'},
+        {'class': 'EntrezGeneFilter'},
+    ],
+    'filters+adders': [
+        {'class': 'RegexFilter'},
+        {'class': 'EntrezGeneFilter'},
+        {'class': 'PatternReplaceAdder',
+         'args': [{r'\s+disease$': ''},
+                  ['CTD (MESH)', 'MeSH desc (Diseases)']]},
+        {'class': 'LookupReplaceAdder',
+         'args': [{'alpha-2 receptor': 'alpha2 receptor'}, ['Swiss-Prot']]},
+    ],
+}
+
+
+def main():
+    '''
+    Run as script.
+    '''
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument(
+        '-n', '--rows', type=int, default=50000000, metavar='N',
+        help='number of rows in the stream (default: %(default)s)')
+    args = ap.parse_args()
+    batches = _batches()
+    n = args.rows // BATCH_SIZE
+    for name, specs in CHAINS.items():
+        results = {}
+        for mode in ('rows', 'chunked'):
+            postfilter = postfilters.combine(
+                [postfilters.from_spec(s) for s in specs])
+            stream = it.islice(it.cycle(batches), n)
+            start = time.time()
+            if mode == 'rows':
+                # Like aggregation without the chunked attribute.
+                rows = postfilter(it.chain.from_iterable(stream))
+                output = map(RowBatch.from_rows, iter_chunks(rows, BATCH_SIZE))
+            else:
+                output = postfilter.chunked(stream)
+            count = sum(map(len, output))
+            results[mode] = count, time.time()-start
+            print('{:15} {:8} {:>10} rows out {:8.1f} s'
+                  .format(name, mode, count, results[mode][1]))
+        assert results['rows'][0] == results['chunked'][0]
+
+
+def _batches():
+    rnd = random.Random(0)
+    batches = []
+    for b in range(DISTINCT_BATCHES):
+        rows = []
+        for i in range(b*BATCH_SIZE, (b+1)*BATCH_SIZE):
+            term = rnd.choice(WORDS)
+            if i % 3:
+                term += ' {}'.format(i)
+            rows.append(('CUI-less', rnd.choice(RESOURCES), str(i), term,
+                         term, 'type'))
+        batches.append(RowBatch.from_rows(rows))
+    return batches
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Benchmark the parallel UniProt preprocessing on synthetic data.
+
+A gzipped XML file resembling uniprot_sprot.xml.gz is
+generated (unless FILE exists already), then processed
+with uniprot.RecordSet.preprocess, once with a single
+worker and once with -j workers.
+The outputs are compared, and wall-clock and CPU times
+of the main process and the workers are reported.
+
+Run from the repository root:
+    python3 -m benchmarks.swissprot [-n ENTRIES] [-j N] FILE
+'''
+
+
+import os
+import gzip
+import time
+import random
+import hashlib
+import argparse
+import resource
+
+from bth.core import settings
+from bth.inputfilters.uniprot import RecordSet
+
+
+def main():
+    '''
+    Run as script.
+    '''
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument(
+        'path', metavar='FILE',
+        help='synthetic Swiss-Prot XML (gzipped), created if missing')
+    ap.add_argument(
+        '-n', '--entries', type=int, default=100000, metavar='N',
+        help='number of entries to generate (default: %(default)s)')
+    ap.add_argument(
+        '-j', '--jobs', type=int, default=settings.preprocess_workers,
+        metavar='N',
+        help='number of worker processes (default: %(default)s)')
+    args = ap.parse_args()
+    if not os.path.exists(args.path):
+        start = time.time()
+        generate(args.path, args.entries)
+        print('generated in {:.1f} s'.format(time.time()-start))
+    digests = set()
+    for workers in sorted({1, args.jobs}):
+        digest, wall, cpu_main, cpu_workers = run(args.path, workers)
+        digests.add(digest)
+        print('{:2d} worker(s): {:7.2f} s wall, CPU: {:7.2f} s main, '
+              '{:7.2f} s workers'.format(workers, wall, cpu_main, cpu_workers))
+    assert len(digests) == 1, 'outputs differ'
+
+
+def run(path, workers):
+    '''
+    Preprocess the file and return the output hash and times.
+    '''
+    settings.preprocess_workers = workers
+    before = _cpu_times()
+    start = time.time()
+    digest = hashlib.sha1()
+    with gzip.open(path) as f:
+        for line in RecordSet.preprocess(f):
+            digest.update(line)
+    wall = time.time() - start
+    after = _cpu_times()
+    return (digest.hexdigest(), wall, *(b-a for a, b in zip(before, after)))
+
+
+def _cpu_times():
+    return tuple(r.ru_utime + r.ru_stime
+                 for r in (resource.getrusage(resource.RUSAGE_SELF),
+                           resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+HEADER = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<uniprot xmlns="http://uniprot.org/uniprot" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://uniprot.org/uniprot \
+http://www.uniprot.org/support/docs/uniprot.xsd">
+'''
+
+FOOTER = '''\
+<copyright>
+Copyrighted by the UniProt Consortium, see https://www.uniprot.org/terms
+</copyright>
+</uniprot>
+'''
+
+ENTRY = '''\
+<entry dataset="Swiss-Prot" created="1986-07-21" modified="2019-01-16" \
+version="{version}">
+<accession>P{id:05d}</accession>
+<accession>Q{id:05d}</accession>
+<name>{name}_HUMAN</name>
+<protein>
+<recommendedName>
+<fullName evidence="2">{pref}</fullName>
+{short}</recommendedName>
+{alternatives}</protein>
+<gene><name type="primary">{gene}</name></gene>
+<organism><name type="scientific">Homo sapiens</name>\
+<dbReference type="NCBI Taxonomy" id="9606"/></organism>
+{references}<comment type="function"><text>{function}</text></comment>
+{features}<sequence length="{length}" mass="1" checksum="X" \
+modified="1986-07-21" version="1">{sequence}</sequence>
+</entry>
+'''
+
+ALTERNATIVE = '''\
+<alternativeName>
+<fullName evidence="1">{} protein {}</fullName>
+<shortName>{}</shortName>
+</alternativeName>
+'''
+
+REFERENCE = '''\
+<reference key="{}"><citation type="journal article" date="2001" name="J" \
+volume="1" first="1" last="9"><title>{}</title><authorList>\
+<person name="{} A."/></authorList><dbReference type="PubMed" id="{}"/>\
+</citation><scope>NUCLEOTIDE SEQUENCE</scope></reference>
+'''
+
+FEATURE = '''\
+<feature type="chain" description="{}"><location><begin position="{}"/>\
+<end position="{}"/></location></feature>
+'''
+
+
+def generate(path, n):
+    '''
+    Write n random entries with the structure of Swiss-Prot.
+
+    Like the real data, the entries include references,
+    features and sequences, which are irrelevant for the
+    Hub, but make up most of the parsing work.
+    '''
+    rnd = random.Random(0)
+    def word():
+        return ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz')
+                       for _ in range(rnd.randint(3, 10)))
+    def words(k):
+        return ' '.join(word() for _ in range(k))
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=3) as f:
+        f.write(HEADER)
+        for i in range(n):
+            sequence = ''.join(rnd.choice('ACDEFGHIKLMNPQRSTVWY')
+                               for _ in range(rnd.randint(100, 600)))
+            f.write(ENTRY.format(
+                version=i % 200,
+                id=i,
+                name=word().upper(),
+                # Tabs must be removed when creating the TSV dump.
+                pref='{}\t{} kinase {}'.format(word(), word(), i),
+                short='<shortName>P{}</shortName>\n'.format(i) if i%3 else '',
+                alternatives=''.join(
+                    ALTERNATIVE.format(word(), i, word().upper())
+                    for _ in range(rnd.randint(0, 3))),
+                gene=word(),
+                references=''.join(
+                    REFERENCE.format(k, words(12), word(),
+                                     rnd.randrange(10**7))
+                    for k in range(rnd.randint(1, 4))),
+                function=words(30),
+                features=''.join(
+                    FEATURE.format(word(), j, j+50)
+                    for j in range(rnd.randint(1, 8))),
+                length=len(sequence),
+                sequence=sequence))
+        f.write(FOOTER)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,15 +10,24 @@ Aggregate records from all the different input filters.
 '''
 
 
+import io
+import os
 import sys
 import csv
 import json
 import logging
 import argparse
+import tempfile
+import itertools as it
+import multiprocessing as mp
 from collections import defaultdict
 
 # Helper modules.
+from . import settings
 from ..lib.tools import Fields, TSVDialect, quiet_option, setup_logging
+from ..lib.tools import RowBatch, spool_batches, read_batches, iter_chunks
+from ..lib.compression import FORMATS, open_compressed
+from ..lib.pairhash import PairHashSet
 
 # Input parsers.
 from ..inputfilters import FILTERS
@@ -29,6 +38,9 @@ from ..lib import postfilters as pflt
 # Statistics.
 from ..stats.bgplotter import BGPlotter
 
+# Caching.
+from .rowcache import RowCache
+
 
 # Cross lookup: ID/term pairs are skipped in "CROSS_DUPLICATES" if they are
 # also found in "CROSS_REFS".
@@ -44,6 +56,82 @@ CROSS_DUPLICATES = {
 }
 
 
+def cross_index_path(dup):
+    '''
+    Path to the precomputed cross-lookup index of a duplicate resource.
+    '''
+    return os.path.join(settings.path_dumps, '{}.xref'.format(dup))
+
+
+def update_cross_index(resource):
+    '''
+    Rebuild all precomputed cross-lookup indices involving this resource.
+
+    This is done at update time, such that aggregation jobs
+    don't have to read the reference resource.
+    '''
+    dups = CROSS_REFS.get(resource, [resource] if resource in CROSS_DUPLICATES
+                                    else [])
+    for dup in dups:
+        if all(os.path.exists(fn) for fn in _cross_dump_fns(dup)):
+            build_cross_index(dup)
+        else:
+            logging.info('no cross-lookup index for %s (missing dumps)', dup)
+
+
+def load_cross_index(dup):
+    '''
+    Load the cross-lookup index of a duplicate resource.
+
+    If the index is missing or outdated, it is rebuilt first.
+    '''
+    path = cross_index_path(dup)
+    try:
+        fresh = os.path.getmtime(path) >= max(
+            os.path.getmtime(fn) for fn in _cross_dump_fns(dup))
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        return build_cross_index(dup)
+    return PairHashSet.load(path)
+
+
+def build_cross_index(dup):
+    '''
+    Collect the ID/term pairs of the reference that also occur in dup.
+
+    Both resources are read with default parameters.
+    '''
+    _, ref = CROSS_DUPLICATES[dup]
+    logging.info('building cross-lookup index for %s...', dup)
+    candidates = PairHashSet(
+        (row.original_id, row.term) for row in FILTERS[dup]())
+    index = PairHashSet()
+    for row in FILTERS[ref]():
+        pair = row.original_id, row.term
+        if pair in candidates:
+            index.add(pair)
+    index.save(cross_index_path(dup))
+    return index
+
+
+def _effective_params(params):
+    '''
+    Drop params that are equivalent to the defaults.
+
+    This includes None values and mappings without any entries
+    (the web server always sends these).
+    '''
+    return {k: v for k, v in params.items()
+            if v is not None
+            and not (isinstance(v, dict) and not any(v.values()))}
+
+
+def _cross_dump_fns(dup):
+    _, ref = CROSS_DUPLICATES[dup]
+    return (*FILTERS[ref].dump_fns(), *FILTERS[dup].dump_fns())
+
+
 def main():
     '''
     Run as script.
@@ -62,6 +150,16 @@ def main():
     ap.add_argument(
         '-p', '--params', type=json.loads, metavar='JSON', default={},
         help='any configuration parameters, given as a JSON object')
+    ap.add_argument(
+        '-j', '--jobs', type=int, metavar='N', default=1,
+        help='read independent resources in N parallel processes '
+             '(default: %(default)s)')
+    ap.add_argument(
+        '-c', '--cache', action='store_true',
+        help='reuse (and store) the rows of each resource in the row cache')
+    ap.add_argument(
+        '-z', '--compress', choices=FORMATS, metavar='FMT',
+        help='compress the output on the fly (%(choices)s)')
     quiet_option(ap)
     args = ap.parse_args()
     if 'all' in args.resources:
@@ -70,19 +168,28 @@ def main():
         args.params['postfilter'] = args.postfilters
 
     setup_logging(args.quiet)
-    rsc = RecordSetContainer(args.resources, **args.params)
-    rsc.write_tsv(sys.stdout.buffer.fileno())
+    rsc = RecordSetContainer(args.resources, workers=args.jobs,
+                             cache=args.cache, **args.params)
+    rsc.write_tsv(sys.stdout.buffer.fileno(), compression=args.compress)
 
 
 class RecordSetContainer(object):
     '''
     Handler for multiple inputfilter instances.
     '''
-    def __init__(self, resources=(), flags=(), **params):
+
+    chunk_size = 10000  # rows per RowBatch
+
+    def __init__(self, resources=(), flags=(), workers=1, cache=None,
+                 **params):
         '''
         Args:
             resources (sequence): resource name, as found in FILTERS
             flags (sequence): flags for eg. cross-lookup
+            workers (int): number of processes for reading resources
+                           in parallel (1: everything in this process)
+            cache (RowCache or bool): reuse rows from previous runs
+                           (True: use a RowCache with default settings)
             params (kwargs): additional params.
                              Filter-specific params can be specified through
                              nesting, ie. the key matches a resource name
@@ -94,9 +201,15 @@ class RecordSetContainer(object):
         self.resources = [(name, FILTERS[name], params.pop(name, {}))
                           for name in sorted(resources, key=self._sort_args)]
         self.flags = frozenset(flags)
+        self.workers = workers
+        if cache is True:
+            cache = RowCache()
+        self.cache = cache or None
         self.params = params  # remaining params -- handled later
 
-        self.cross_lookup = defaultdict(set)
+        self.cross_lookup = defaultdict(PairHashSet)
+        self._segments = {}  # row-cache segment names
+        self._global_params = {}  # params for all filters (current run)
 
     @staticmethod
     def _sort_args(arg):
@@ -113,87 +226,245 @@ class RecordSetContainer(object):
         '''
         if resource in CROSS_REFS:
             # Check if any associated duplicates are
-            # 1) present and 2) have their cross-lookup flag set.
+            # 1) present, 2) have their cross-lookup flag set, and
+            # 3) can't use the precomputed index.
             for dup in CROSS_REFS[resource]:
                 present = any(n == dup for n, _, _ in self.resources)
-                flag = CROSS_DUPLICATES[dup][0]
-                if present and flag in self.flags:
+                if (present and self._check_cross_duplicate(dup)
+                        and not self._precomputed_lookup(dup)):
                     return True
         return False
 
-    def _iter_resources(self, **kwargs):
+    def _check_cross_duplicate(self, resource):
         '''
-        Iterate over the readily initialised inputfilters.
+        Check if a resource must be filtered through cross-lookup.
+        '''
+        if resource in CROSS_DUPLICATES:
+            flag, _ = CROSS_DUPLICATES[resource]
+            return flag in self.flags
+        return False
+
+    def _precomputed_lookup(self, resource):
+        '''
+        Check if a duplicate can be filtered with the index built at update.
+
+        The index covers the default configuration only, so it
+        can't be used if any of the dump paths is customised, if
+        the reference resource is selected with custom params, or
+        if any params are given for all resources (eg. idprefix).
+        '''
+        if self._global_params:
+            return False
+        _, ref = CROSS_DUPLICATES[resource]
+        for name, _, params in self.resources:
+            if name == ref and params or name == resource and 'fn' in params:
+                return False
+        return True
+
+    def _iter_specs(self, **kwargs):
+        '''
+        Iterate over name/constructor/params triples.
         '''
         for name, constr, custom_params in self.resources:
             # Prepare cascaded parameter overriding.
             params = dict()
             # Check if a cross-lookup has to be performed for the resource
             # and if so, pass the corresponding lookup set.
-            if name in CROSS_DUPLICATES:
-                flag, ref = CROSS_DUPLICATES[name]
-                if flag in self.flags:
+            if self._check_cross_duplicate(name):
+                if self._precomputed_lookup(name):
+                    params['exclude'] = load_cross_index(name)
+                else:
+                    _, ref = CROSS_DUPLICATES[name]
                     params['exclude'] = self.cross_lookup[ref]
             # Override with any filter-specific and local params.
             params.update(custom_params)
             params.update(kwargs)
-            # Create the filter instance and collect some properties.
-            recordset = constr(**params)
-            yield recordset, name
+            yield name, constr, params
 
-    def write_tsv(self, filename, **kwargs):
+    def write_tsv(self, filename, compression=None, member='termlist.csv',
+                  **kwargs):
         '''
         Concatenate all resources' data into a large TSV file.
+
+        If compression is given (any of "gz", "zip", "zst"),
+        the output is compressed in a background thread.
+        For zip archives, `member` is the name of the TSV inside.
         '''
-        with open(filename, 'wt', encoding='utf-8', newline='') as f:
+        if compression is None:
+            f = open(filename, 'wt', encoding='utf-8', newline='')
+        else:
+            f = io.TextIOWrapper(open_compressed(filename, compression, member),
+                                 encoding='utf-8', newline='')
+        with f:
             writer = csv.writer(f, dialect=TSVDialect)
-            writer.writerows(self.iter_rows(**kwargs))
+            for batch in self.iter_batches(**kwargs):
+                writer.writerows(batch.tuples())
 
     def iter_rows(self, **kwargs):
         '''
         Iterate over all rows of all resources.
         '''
+        return it.chain.from_iterable(self.iter_batches(**kwargs))
+
+    def iter_batches(self, **kwargs):
+        '''
+        Iterate over all rows of all resources in RowBatch chunks.
+        '''
         # Mix in parameters defined in the constructor.
         params = dict(self.params, **kwargs)
-        return self._iter_rows(**params)
+        return self._iter_batches(**params)
 
-    def _iter_rows(self, header=True, postfilter=None, stats=None, **kwargs):
+    def _iter_batches(self, header=True, postfilter=None, stats=None,
+                      **kwargs):
         if header:
-            yield Fields._fields
-        rows = self._all_rows(**kwargs)
+            yield RowBatch.from_rows([Fields._fields])
+        batches = self._all_batches(**kwargs)
         if postfilter is not None:
-            rows = postfilter(rows)
+            if hasattr(postfilter, 'chunked'):
+                # Let the postfilter handle many rows at once.
+                batches = postfilter.chunked(batches)
+            else:
+                rows = postfilter(it.chain.from_iterable(batches))
+                batches = map(RowBatch.from_rows,
+                              iter_chunks(rows, self.chunk_size))
         if stats is not None:
-            rows = self._collect_stats(rows, stats)
-        yield from rows
+            batches = self._collect_stats(batches, stats)
+        yield from batches
 
-    def _all_rows(self, **kwargs):
+    def _all_batches(self, **kwargs):
         logging.info('aggregating %d resource(s)', len(self.resources))
-        for recordset, resource in self._iter_resources(**kwargs):
-            logging.info('processing %s...', resource)
-            if self._check_cross_lookup(resource):
-                # Iterate with cross-lookup handling.
-                for row in recordset:
-                    # Keep all ID-term pairs in memory, so that they can be
-                    # skipped in the duplicate resource.
-                    self.cross_lookup[resource].add(
-                        (row.original_id, row.term))
-                    yield row
-            else:
-                # No cross-lookup handling.
-                yield from recordset
+        self._global_params = _effective_params(kwargs)
+        if self.workers > 1:
+            yield from self._parallel_batches(**kwargs)
+        else:
+            for name, constr, params in self._iter_specs(**kwargs):
+                logging.info('processing %s...', name)
+                batches = self._cached(name, constr, params,
+                                       self._instantiate(constr, params))
+                yield from self._resource_batches(batches, name)
         logging.info('done.')
 
+    @classmethod
+    def _instantiate(cls, constr, params):
+        '''
+        Create the filter instance only once iteration starts.
+        '''
+        yield from constr(**params).iter_batches(cls.chunk_size)
+
+    def _cached(self, name, constr, params, batches):
+        '''
+        Get rows from the row cache, or cache them on the fly.
+        '''
+        if self.cache is None:
+            return batches
+        segment = self._segment(name, constr, params)
+        self._segments[name] = segment
+        return self.cache.batches(segment, batches)
+
+    def _is_cached(self, name, constr, params):
+        if self.cache is None:
+            return False
+        segment = self._segment(name, constr, params)
+        return self.cache.get(segment) is not None
+
+    def _segment(self, name, constr, params):
+        ref = None
+        dump_fns = params.get('fn') or constr.dump_fns()
+        if isinstance(dump_fns, str):
+            dump_fns = (dump_fns,)
+        if self._check_cross_duplicate(name):
+            if self._precomputed_lookup(name):
+                # The rows depend on the state of the index.
+                dump_fns = (*dump_fns, cross_index_path(name))
+            else:
+                # The rows depend on the reference resource's configuration.
+                ref = self._segments.get(CROSS_DUPLICATES[name][1])
+        return self.cache.segment(name, dump_fns, params, ref)
+
+    def _resource_batches(self, batches, resource):
+        if self._check_cross_lookup(resource):
+            # Iterate with cross-lookup handling.
+            lookup = self.cross_lookup[resource]
+            path = None
+            if self.cache is not None:
+                # The lookup set is kept along with the cached rows.
+                segment = self._segments[resource]
+                path = self.cache.sidecar(segment, '.xref')
+                if self.cache.get(segment) is not None and path.exists():
+                    lookup.update(PairHashSet.load(str(path)))
+                    yield from batches
+                    return
+            for batch in batches:
+                # Keep (hashes of) all ID-term pairs in memory, so that they
+                # can be skipped in the duplicate resource.
+                for pair in zip(batch.column('original_id'),
+                                batch.column('term')):
+                    lookup.add(pair)
+                yield batch
+            if path is not None:
+                lookup.save(str(path))
+        else:
+            # No cross-lookup handling.
+            yield from batches
+
+    def _parallel_batches(self, **kwargs):
+        '''
+        Read independent resources in worker processes.
+
+        Each worker spools the rows of one resource to a
+        temporary file, which is read back in the original
+        order.
+        Resources involved in a cross-lookup at runtime are
+        read in this process, since they share the lookup set.
+        The same goes for resources found in the row cache.
+        '''
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mp.Pool(self.workers) as pool:
+            jobs = []
+            for name, constr, params in self._iter_specs(**kwargs):
+                if (self._check_cross_lookup(name)
+                        or self._check_cross_duplicate(name)
+                        and not self._precomputed_lookup(name)
+                        or self._is_cached(name, constr, params)):
+                    job = None  # postponed, see below
+                else:
+                    path = os.path.join(tmpdir, name)
+                    job = pool.apply_async(
+                        _spool_resource,
+                        (name, constr, params, path, self.chunk_size))
+                jobs.append((name, constr, params, job))
+            for name, constr, params, job in jobs:
+                if job is None:
+                    # Instantiate only now, as the lookup set of a
+                    # duplicate resource has been filled by now.
+                    logging.info('processing %s...', name)
+                    batches = self._instantiate(constr, params)
+                else:
+                    batches = read_batches(job.get())
+                batches = self._cached(name, constr, params, batches)
+                yield from self._resource_batches(batches, name)
+
     @staticmethod
-    def _collect_stats(rows, stats):
+    def _collect_stats(batches, stats):
         '''
         While compiling the term list, collect and plot some statistics
         in the background.
         '''
         if not isinstance(stats, BGPlotter):
             stats = BGPlotter(stats)
-        for row in rows:
-            stats.update(row.original_id, row.term, row.entity_type)
-            yield row
+        for batch in batches:
+            for id_, term, entity_type in zip(batch.column('original_id'),
+                                              batch.column('term'),
+                                              batch.column('entity_type')):
+                stats.update(id_, term, entity_type)
+            yield batch
         # Start plotting (non-blocking).
         stats.plot()
+
+
+def _spool_resource(name, constr, params, path, chunk_size):
+    '''
+    Worker function: write all rows of a resource to a file.
+    '''
+    logging.info('processing %s...', name)
+    return spool_batches(constr(**params).iter_batches(chunk_size), path)
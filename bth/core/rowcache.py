@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+On-disk cache for the rows of individual resources.
+'''
+
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+from . import settings
+from ..lib.tools import read_batches, tee_spool
+
+
+class RowCache:
+    '''
+    Cache of finished rows, one segment per resource.
+
+    A segment holds the rows of a resource as produced by
+    the inputfilter, ie. after applying `mapping`, `idprefix`
+    etc., but before any postfiltering.
+    The segment name is derived from the resource name(s)
+    and a hash of the dump m-times and the filter parameters.
+    '''
+
+    suffix = '.rows'
+
+    def __init__(self, root=settings.path_row_cache,
+                 max_size=settings.row_cache_size):
+        self.root = Path(root)
+        self.max_size = max_size
+
+    def segment(self, name, dump_fns, params, ref=None):
+        '''
+        Determine the segment name for this resource configuration.
+
+        If the rows depend on another resource (cross-lookup),
+        `ref` is the segment name of that resource.
+        '''
+        if isinstance(dump_fns, str):
+            dump_fns = (dump_fns,)
+        mtimes = [int(os.path.getmtime(fn)) for fn in dump_fns]
+        params = {k: v for k, v in params.items() if k != 'exclude'}
+        key = json.dumps([name, mtimes, params, ref],
+                         sort_keys=True, default=str)
+        digest = hashlib.sha1(key.encode('utf8')).hexdigest()
+        tags = [name]
+        if ref is not None:
+            tags.append(ref.split('-', 1)[0])
+        return '{}-{}{}'.format('+'.join(tags), digest, self.suffix)
+
+    def sidecar(self, segment, suffix):
+        '''
+        Path to an auxiliary file belonging to a segment.
+
+        Sidecar files are removed together with their segment.
+        '''
+        return self.root / (segment + suffix)
+
+    def get(self, segment):
+        '''
+        Get the path to a cached segment, or None if it doesn't exist.
+        '''
+        path = self.root / segment
+        try:
+            # Update the m-time, which is used for LRU eviction.
+            os.utime(str(path))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def batches(self, segment, batches):
+        '''
+        Iterate over the cached row batches of this segment.
+
+        If the segment isn't cached yet, iterate over `batches`
+        and add them to the cache on the fly.
+        '''
+        path = self.get(segment)
+        if path is not None:
+            logging.info('reading cached rows (%s)', segment)
+            return read_batches(path)
+        return self._store(segment, batches)
+
+    def _store(self, segment, batches):
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Concurrent jobs might be creating the same segment,
+        # so each of them gets a unique temp file.
+        path = str(self.root / segment)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                yield from tee_spool(batches, f)
+            os.rename(tmp, path)
+        finally:
+            # Remove incomplete segments (eg. if iteration was aborted).
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove least-recently used segments until the size limit is met.
+        '''
+        segments = [(p.stat(), p) for p in self.root.glob('*' + self.suffix)]
+        segments.sort(key=lambda s: s[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in segments)
+        for stat, path in segments:
+            if total <= self.max_size:
+                break
+            logging.info('evicting %s from the row cache', path.name)
+            self._unlink(path)
+            total -= stat.st_size
+
+    def invalidate(self, name):
+        '''
+        Remove all segments depending on this resource.
+        '''
+        for path in self.root.glob('*' + self.suffix):
+            tags = path.name.split('-', 1)[0].split('+')
+            if name in tags:
+                self._unlink(path)
+
+    @staticmethod
+    def _unlink(path):
+        for p in (path, *path.parent.glob(path.name + '.*')):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                # Removed by a concurrent process.
+                pass
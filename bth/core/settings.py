@@ -103,6 +103,7 @@ def data(*args):
 path_dumps = data('dumps')
 path_update_logs = data('dumps', 'updates')
 path_umls_maps = data('dumps', 'umls')
+path_staging = data('dumps', 'staging')
 
 # Do not attempt to update resources if they are younger than min_update_freq.
 
@@ -116,6 +117,30 @@ min_check_freq = 4*60*60  # 4 hours
 
 timeout = 10  # seconds
 
+# When checking many resources for remote changes at once, send up to
+# check_threads HEAD requests simultaneously and give up after check_timeout.
+
+check_threads = 16
+check_timeout = 30  # seconds (for all resources together)
+
+# Staged downloads: save the payload to path_staging before processing it,
+# resuming with HTTP range requests if the connection drops.
+
+stage_downloads = False
+download_retries = 5
+download_retry_wait = 10  # seconds (doubled after each failure)
+
+# When updating resources in parallel, limit the number of simultaneous
+# downloads from the same host.
+
+max_downloads_per_host = 2
+
+# Threaded pipelines: run each processing step of an update in a separate
+# thread, buffering up to pipeline_queue_size chunks between two steps.
+
+threaded_pipelines = False
+pipeline_queue_size = 16
+
 # When checking for concurrent updates, ignore temp files older than this.
 
 concurrent_update_dead = 120  # seconds
@@ -129,6 +154,22 @@ concurrent_update_wait_interval = 15  # seconds
 
 tempfile_buffer_size = 2**30  # Bytes (0: never write to disk)
 
+# Number of worker processes for CPU-heavy preprocessing steps
+# (eg. extracting UMLS entries).
+
+preprocess_workers = os.cpu_count() or 1
+
+
+#
+# Aggregation cache: rows of previously processed resources.
+#
+
+path_row_cache = data('cache')
+
+# Evict the least-recently used entries when the cache exceeds this size.
+
+row_cache_size = 2**34  # Bytes (16 GiB)
+
 
 #
 # Google-books n-grams for the common-words postfilter
@@ -138,6 +179,9 @@ gen_voc_year_threshold = 1990
 gen_voc_occ_threshold = 1e-7
 gen_voc_db_file = data(
     'dumps', 'googlebooks-1grams-f-{}.tsv.gz'.format(gen_voc_occ_threshold))
+# Binary copy sorted by frequency, for fast loading.
+gen_voc_lexicon_file = data(
+    'dumps', 'googlebooks-1grams-f-{}.lex'.format(gen_voc_occ_threshold))
 
 
 #
@@ -13,10 +13,14 @@ import os
 import re
 import csv
 import logging
+import operator
 from collections import defaultdict
 
 from ..core import settings
-from ..lib.tools import Fields, URI_PREFIX
+from ..lib.tools import Fields, RowBatch, URI_PREFIX, iter_chunks, \
+    is_fresh, locked
+from ..lib import compactdump
+from ..lib.pairhash import PairHashMap
 
 
 class AbstractRecordSet(object):
@@ -32,6 +36,9 @@ class AbstractRecordSet(object):
     remote = None
     source_ref = None
 
+    # Can the update pipelines of multiple remotes run concurrently?
+    concurrent_remotes = False
+
     def __init__(self, fn=None, mapping=None, idprefix=None):
         self.fn = self._resolve_dump_fns(fn)
         self.prefix_id = self._handle_prefix(idprefix)
@@ -41,6 +48,13 @@ class AbstractRecordSet(object):
     def __iter__(self):
         raise NotImplementedError
 
+    def iter_batches(self, size=10000):
+        '''
+        Iterate over term entries in RowBatch chunks.
+        '''
+        for chunk in iter_chunks(self, size):
+            yield RowBatch.from_rows(chunk)
+
     @classmethod
     def dump_label(cls):
         '''
@@ -121,6 +135,13 @@ class AbstractRecordSet(object):
     def _update_steps():
         return ()
 
+    @classmethod
+    def compile_dumps(cls):
+        '''
+        Hook for post-processing the dump files after an update.
+        '''
+        pass
+
     @classmethod
     def dump_fns(cls):
         '''
@@ -153,6 +174,14 @@ class IterConceptRecordSet(AbstractRecordSet):
 
     NO_CUI = 'CUI-less'
 
+    # Does _concept_rows() read the dump in the canonical format?
+    # If so, a compact binary copy is created after each update.
+    compact_dump = True
+
+    # Column for grouping the rows of the compact dump into labeled
+    # blocks (eg. rank), which allows skipping irrelevant rows.
+    compact_key = None
+
     def __iter__(self):
         '''
         Iterate over term entries (1 per synonym).
@@ -169,6 +198,23 @@ class IterConceptRecordSet(AbstractRecordSet):
                                entity_type)
                 yield entry
 
+    def iter_batches(self, size=10000):
+        '''
+        Iterate over term entries in RowBatch chunks.
+
+        The rows are added directly to the columns,
+        without creating a Fields tuple for each.
+        '''
+        batch = RowBatch()
+        for id_, cui, pref, terms, entity_type, resource in self._cui_concepts():
+            batch.add_synonyms(cui, resource, self.prefix_id(id_), terms, pref,
+                               entity_type)
+            if len(batch) >= size:
+                yield batch
+                batch = RowBatch()
+        if batch:
+            yield batch
+
     def _cui_concepts(self):
         '''
         Iterate over ID/CUI/pref/terms/type/source sextuples.
@@ -183,11 +229,33 @@ class IterConceptRecordSet(AbstractRecordSet):
         for id_, pref, *terms in self._concept_rows():
             yield id_, pref, terms, self.entity_type, self.resource
 
-    def _concept_rows(self):
-        with open(self.fn, encoding='utf-8') as f:
+    def _concept_rows(self, keys=None):
+        # If keys are given, rows in other blocks of the compact dump
+        # are skipped (but the caller still needs to filter the rest).
+        bin_fn = compactdump.path_for(self.fn)
+        if self.compact_dump and compactdump.is_fresh(bin_fn, self.fn):
+            return compactdump.read(bin_fn, keys)
+        return self._read_tsv(self.fn)
+
+    @staticmethod
+    def _read_tsv(fn):
+        with open(fn, encoding='utf-8') as f:
             for line in f:
                 yield line.rstrip('\n').split('\t')
 
+    @classmethod
+    def compile_dumps(cls):
+        '''
+        Create a compact binary copy of the canonical TSV dump.
+        '''
+        if cls.compact_dump:
+            key = None
+            if cls.compact_key is not None:
+                key = operator.itemgetter(cls.compact_key)
+            for fn in cls.dump_fns():
+                compactdump.write(cls._read_tsv(fn), compactdump.path_for(fn),
+                                  key=key)
+
     # Line template for the canonical iter-concepts format.
     _line_template = '{id}\t{pref}\t{terms}\n'
 
@@ -197,6 +265,9 @@ class IterConceptRecordSet(AbstractRecordSet):
         return line.encode('utf-8')
 
 
+_missing_cui_maps = set()  # warn only once
+
+
 class UMLSIterConceptMixin:
     '''
     Mix-in for IterConceptRecordSet subclasses with UMLS CUIs.
@@ -228,19 +299,39 @@ class UMLSIterConceptMixin:
 
     @classmethod
     def _load_cui_map(cls, sab=None):
-        cui_map = defaultdict(set)
+        # Use the hashed index, (re-)creating it if necessary.
+        dump_fn, index_fn = cls.umls_dump_fn(sab), cls.umls_index_fn(sab)
         try:
-            for cui, id_, term in cls._read_cui_map(sab):
-                cui_map[id_, term].add(cui)
+            if not is_fresh(index_fn, dump_fn):
+                # Concurrent pipelines and worker processes (eg. one per
+                # chunk) shouldn't create the same index at the same time.
+                with locked(dump_fn):
+                    if not is_fresh(index_fn, dump_fn):
+                        cls.index_cui_map(dump_fn, index_fn)
+            return PairHashMap(index_fn)
         except FileNotFoundError:
-            logging.warning('CUI map not found (%s)', cls.umls_dump_fn(sab))
-        cui_map = {k: '/'.join(cuis) for k, cuis in cui_map.items()}
-        return cui_map
+            # (Called once per chunk when preprocessing in parallel.)
+            if dump_fn not in _missing_cui_maps:
+                _missing_cui_maps.add(dump_fn)
+                logging.warning('CUI map not found (%s)', dump_fn)
+            return {}
+
+    @staticmethod
+    def _read_cui_map(fn):
+        cui_map = defaultdict(set)
+        with open(fn, 'r', encoding='utf-8') as f:
+            rows = csv.reader(f, delimiter='\t', quotechar=None)
+            for cui, id_, term in rows:
+                cui_map[id_, term].add(cui)
+        return {k: '/'.join(cuis) for k, cuis in cui_map.items()}
 
     @classmethod
-    def _read_cui_map(cls, sab=None):
-        with open(cls.umls_dump_fn(sab), 'r', encoding='utf-8') as f:
-            yield from csv.reader(f, delimiter='\t', quotechar=None)
+    def index_cui_map(cls, dump_fn, index_fn):
+        '''
+        Create a hashed index for looking up CUIs by (ID, term).
+        '''
+        logging.info('Indexing %s', dump_fn)
+        PairHashMap.write(cls._read_cui_map(dump_fn).items(), index_fn)
 
     @classmethod
     def umls_dump_fn(cls, sab=None):
@@ -249,3 +340,10 @@ class UMLSIterConceptMixin:
         '''
         fn = '{}.tsv'.format(sab or cls.umls_abb)
         return os.path.join(settings.path_umls_maps, fn)
+
+    @classmethod
+    def umls_index_fn(cls, sab=None):
+        '''
+        Path to the hashed index of the CUI-mapping TSV.
+        '''
+        return os.path.splitext(cls.umls_dump_fn(sab))[0] + '.idx'
@@ -14,6 +14,8 @@ import io
 import logging
 
 from ._base import IterConceptRecordSet
+from ..core import settings
+from ..lib.tools import pool_imap
 
 
 class OboRecordSet(IterConceptRecordSet):
@@ -30,22 +32,54 @@ class OboRecordSet(IterConceptRecordSet):
         else:
             return lambda id_: prefix+id_.replace(':', '_')
 
+    # Approximate size of the text chunks parsed by the worker processes.
+    chunk_size = 2**22  # characters
+
     @classmethod
     def preprocess(cls, stream):
         '''
         Parse .obo stanzas and produce extended _iter_concepts format.
+
+        The stanzas are parsed in chunks by parallel worker processes.
         '''
         stream = io.TextIOWrapper(stream, encoding='utf-8')
-        for concept in cls.iter_stanzas(stream):
-            yield cls._canonical_line(**concept)
+        chunks = cls._split_stanzas(stream, cls.chunk_size)
+        for lines in pool_imap(cls._preprocess_chunk, chunks,
+                               settings.preprocess_workers):
+            yield from lines
+
+    @classmethod
+    def _preprocess_chunk(cls, chunk):
+        return [cls._canonical_line(**concept)
+                for concept in cls.iter_stanzas(io.StringIO(chunk))]
+
+    @staticmethod
+    def _split_stanzas(stream, size):
+        '''
+        Cut the text into chunks at [Term] boundaries.
+
+        Chunks are only cut before a [Term] header preceded by
+        a blank line, ie. where the parser state is reset anyway.
+        '''
+        boundary = re.compile(r'\n[^\S\n]*\n(?=[^\S\n]*\[Term\][^\S\n]*\n)')
+        buffer = ''
+        for block in iter(lambda: stream.read(size), ''):
+            buffer += block
+            cut = max((m.end() for m in boundary.finditer(buffer)), default=0)
+            if cut:
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        if buffer:
+            yield buffer
 
     @classmethod
     def iter_stanzas(cls, stream):
         '''
         Parse the .obo stanzas.
         '''
-        tag_value = re.compile(r'(\w+): (.+)')
         synonym_type = re.compile(r'"((?:[^"]|\\")*)" ([A-Z]+)')
+        # Any other tags are skipped without further inspection.
+        relevant = {'id', 'namespace', 'name', 'synonym', 'is_obsolete'}
 
         inside = False
         concept = {}
@@ -62,11 +96,12 @@ class OboRecordSet(IterConceptRecordSet):
                 inside = True
                 concept['terms'] = set()
             elif inside:
-                try:
-                    tag, value = tag_value.match(line).groups()
-                except AttributeError:
+                tag, sep, value = line.partition(': ')
+                if not sep:
                     logging.warning('invalid OBO line: %r', line)
                     continue
+                if tag not in relevant:
+                    continue
                 if tag == 'id':
                     concept['id'] = value
                 elif tag == 'namespace':
@@ -80,7 +115,8 @@ class OboRecordSet(IterConceptRecordSet):
                         # Unescape quotes.
                         synonym = synonym.replace('\\"', '"')
                         concept['terms'].add(synonym)
-                elif (tag, value) == ('is_obsolete', 'true'):
+                elif value == 'true':
+                    # is_obsolete
                     concept['obsolete'] = True
         if 'id' in concept:
             # After the final stanza: last yield.
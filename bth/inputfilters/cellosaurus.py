@@ -26,6 +26,7 @@ class RecordSet(IterConceptRecordSet):
     dump_fn = 'cellosaurus.txt'
     remote = 'ftp://ftp.expasy.org/databases/cellosaurus/cellosaurus.txt'
     source_ref = 'http://web.expasy.org/cellosaurus/'
+    compact_dump = False  # custom dump format
 
     def _iter_concepts(self):
         '''
@@ -15,11 +15,15 @@ functionality.
 '''
 
 
+import os
 import csv
 import codecs
-from collections import defaultdict
+import tempfile
+import threading
+from array import array
 
 from ._obo import OboRecordSet
+from ..core import settings
 
 
 class RecordSet(OboRecordSet):
@@ -36,25 +40,26 @@ class RecordSet(OboRecordSet):
                    for name in ('compounds', 'names'))
     source_ref = 'https://www.ebi.ac.uk/chebi/'
     languages = ('en', 'la')  # only consider synonyms of these languages
+    concurrent_remotes = True  # see _Merger
 
     @classmethod
     def update_info(cls):
         # Special scenario: a single dump file depends on two distinct
         # remote source files (unlike ncbitax, where the dump depends on
         # two members of a remote archive).
-        # Combine them with two wrappers which enable sharing an object
-        # between the two pipelines.
+        # The two pipelines share a merger object, which writes the dump
+        # as soon as both parts are available.
         comp_src, name_src = cls.remote
         dec = codecs.getreader('utf8')  # stream decoder
-        names_container = []  # closure variable to pass around "names" dict
+        merger = _Merger(cls._merge_comp_names, cls._resolve_dump_fns())
         def load_names(stream):
-            'Wrapper for saving the "names" dict.'
-            names_container.append(cls._load_names(stream))
+            'Wrapper for passing on the names table.'
+            merger.names(cls._load_names(dec(stream)))
         def merge(stream):
-            'Wrapper for passing the "names" dict.'
-            return cls._merge_comp_names(stream, names_container[0])
-        return [(name_src, 'gz', dec, load_names),
-                (comp_src, 'gz', dec, merge, cls.dump_fn)]
+            'Wrapper for passing on the compounds.'
+            merger.compounds(cls._select_comp(dec(stream)))
+        return [(name_src, 'gz', load_names),
+                (comp_src, 'gz', merge)]
 
     @classmethod
     def preprocess(cls, compounds, names):
@@ -62,12 +67,13 @@ class RecordSet(OboRecordSet):
         Read compounds and synonymous names from two TSV streams.
         '''
         # This is a convenience method not used by cls.update_info().
-        return cls._merge_comp_names(compounds, cls._load_names(names))
+        return cls._merge_comp_names(cls._select_comp(compounds),
+                                     cls._load_names(names))
 
     @classmethod
     def _merge_comp_names(cls, compounds, names):
-        for compid, chid, pref in cls._select_comp(compounds):
-            terms = set(names.get(compid, ()))
+        for compid, chid, pref in compounds:
+            terms = set(names.get(int(compid)))
             terms.add(pref)
             terms.discard('null')
             if terms:
@@ -78,13 +84,11 @@ class RecordSet(OboRecordSet):
 
     @classmethod
     def _load_names(cls, stream):
-        names = defaultdict(list)
         reader = csv.reader(stream, delimiter='\t')
         next(reader)  # skip header line
-        for _, compid, _, _, name, _, lang in reader:
-            if lang in cls.languages:
-                names[compid].append(name)
-        return names
+        return _NameTable((int(compid), name)
+                          for _, compid, _, _, name, _, lang in reader
+                          if lang in cls.languages)
 
     @classmethod
     def _select_comp(cls, stream):
@@ -97,3 +101,100 @@ class RecordSet(OboRecordSet):
     iter_stanzas = None
     relevant_synonym = None
     _update_steps = None
+
+
+class _NameTable:
+    '''
+    Compact lookup table for the names of each compound.
+
+    The UTF-8 encoded names are stored in a single buffer,
+    grouped by compound ID, with an array of start positions
+    indexed by the ID (ChEBI IDs are dense integers).
+    The grouping is a counting sort, which keeps the
+    original order of the names of each compound.
+    '''
+    def __init__(self, pairs):
+        ids, offsets, blob = array('L'), array('Q', [0]), bytearray()
+        for compid, name in pairs:
+            ids.append(compid)
+            blob += name.encode('utf-8')
+            blob += b'\0'
+            offsets.append(len(blob))
+        # Start positions: cumulative sizes per compound.
+        starts = array('Q', bytes(8 * (max(ids, default=0) + 2)))
+        for i, compid in enumerate(ids):
+            starts[compid+1] += offsets[i+1] - offsets[i]
+        for compid in range(1, len(starts)):
+            starts[compid] += starts[compid-1]
+        cursor = array('Q', starts)
+        self._blob = bytearray(len(blob))
+        for i, compid in enumerate(ids):
+            start, end = offsets[i], offsets[i+1]
+            pos = cursor[compid]
+            cursor[compid] = pos + end - start
+            self._blob[pos:cursor[compid]] = blob[start:end]
+        self._starts = starts
+
+    def get(self, compid):
+        '''Get the names of this compound (if any).'''
+        if compid+1 >= len(self._starts):
+            return ()
+        names = self._blob[self._starts[compid]:self._starts[compid+1]]
+        return names.decode('utf-8').split('\0')[:-1]
+
+
+class _Merger:
+    '''
+    Join the outputs of the concurrent compounds and names pipelines.
+
+    The pipeline finishing last writes the dump file.
+    If the names table is ready in time, the compounds are
+    merged on the fly; otherwise they are spooled to a temp
+    file (kept in memory up to `settings.tempfile_buffer_size`).
+    If one of the pipelines fails, the other one doesn't wait.
+    '''
+    def __init__(self, merge, dump_fn):
+        self._merge = merge
+        self._dump_fn = dump_fn
+        self._lock = threading.Lock()
+        self._names = None
+        self._spool = None
+
+    def names(self, table):
+        '''Provide the names table.'''
+        with self._lock:
+            self._names = table
+            spool, self._spool = self._spool, None
+        if spool is not None:
+            self._write_spooled(spool)
+
+    def compounds(self, rows):
+        '''Provide the compound rows.'''
+        with self._lock:
+            ready = self._names is not None
+        if ready:
+            self._write(rows)
+            return
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=settings.tempfile_buffer_size)
+        for row in rows:
+            spool.write('\t'.join(row).encode('utf-8') + b'\n')
+        with self._lock:
+            ready = self._names is not None
+            if not ready:
+                # The names pipeline will take care of the rest.
+                self._spool = spool
+        if ready:
+            self._write_spooled(spool)
+
+    def _write_spooled(self, spool):
+        with spool:
+            spool.seek(0)
+            rows = (line.decode('utf-8').rstrip('\n').split('\t')
+                    for line in spool)
+            self._write(rows)
+
+    def _write(self, rows):
+        with open(self._dump_fn + '.tmp', 'wb') as f:
+            f.writelines(self._merge(rows, self._names))
+        os.rename(self._dump_fn + '.tmp', self._dump_fn)
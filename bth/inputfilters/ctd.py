@@ -16,6 +16,7 @@ import itertools as it
 from collections.abc import Mapping
 
 from ._base import IterConceptRecordSet, UMLSIterConceptMixin
+from ..lib.pairhash import PairHashSet
 
 
 class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
@@ -48,7 +49,9 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
         self._resource_mapping = {
             plain: self.mapping(mapping, 'resource', wrapped)
             for plain, wrapped in self._resource_names.items()}
-        self._exclude = frozenset(exclude)
+        if not isinstance(exclude, PairHashSet):
+            exclude = frozenset(exclude)
+        self._exclude = exclude
 
     def _prefix_factory(self, prefix):
         if isinstance(prefix, Mapping):
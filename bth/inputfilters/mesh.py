@@ -9,14 +9,18 @@ Collect MeSH descriptions and supplements ("mesh-{desc,supp}.json.pile").
 '''
 
 
+import io
 import json
+from functools import partial
 from collections import namedtuple
 from datetime import datetime
 
 from lxml import etree
 
 from ._base import IterConceptRecordSet, UMLSIterConceptMixin
-from ..lib.tools import classproperty
+from ..core import settings
+from ..lib.tools import classproperty, pool_imap
+from ..lib.xmlchunks import split_records
 
 
 # These headings for the initial letter of the MeSH Tree numbers are not given
@@ -59,6 +63,8 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
     _remote = 'ftp://nlmpubs.nlm.nih.gov/online/mesh/MESH_FILES/xmlmesh/{}{}.gz'
     source_ref = 'https://www.nlm.nih.gov/mesh/meshhome.html'
     umls_abb = 'MSH'
+    compact_dump = False  # custom dump format
+    concurrent_remotes = True  # desc and supp are independent
 
     @classproperty
     def remote(cls):
@@ -139,6 +145,28 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
         '''
         Preprocess DescriptorRecord entries and save them in a JSON pile.
         '''
+        return cls._prep_parallel(stream, 'DescriptorRecord', cls._parse_desc)
+
+    @classmethod
+    def _prep_supp(cls, stream):
+        '''
+        Preprocess SupplementalRecord entries and save them in a JSON pile.
+        '''
+        return cls._prep_parallel(stream, 'SupplementalRecord',
+                                  cls._parse_supp)
+
+    @staticmethod
+    def _prep_parallel(stream, tag, parse):
+        '''
+        Parse chunks of records in worker processes.
+        '''
+        chunks = split_records(stream, tag)
+        for entries in pool_imap(partial(_parse_chunk, parse), chunks,
+                                 settings.preprocess_workers):
+            yield from entries
+
+    @staticmethod
+    def _parse_desc(stream):
         for _, record in etree.iterparse(stream, tag='DescriptorRecord'):
             # DescriptorName/String seems to be always the same as
             # .//Term[@RecordPreferredTermYN="Y"]/String,
@@ -151,21 +179,18 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
             yield (
                 record.find('DescriptorUI').text,
                 record.find('DescriptorName/String').text,
-                tuple(set(n.text for n in record.iterfind('.//Term/String'))),
+                _unique(n.text for n in record.iterfind('.//Term/String')),
                 [n.text[0] for n in record.iterfind('.//TreeNumber')],
             )
             record.clear()
 
-    @classmethod
-    def _prep_supp(cls, stream):
-        '''
-        Preprocess SupplementalRecord entries and save them in a JSON pile.
-        '''
+    @staticmethod
+    def _parse_supp(stream):
         for _, record in etree.iterparse(stream, tag='SupplementalRecord'):
             yield (
                 record.find('SupplementalRecordUI').text,
                 record.find('SupplementalRecordName/String').text,
-                tuple(set(n.text for n in record.iterfind('.//Term/String'))),
+                _unique(n.text for n in record.iterfind('.//Term/String')),
                 [n.text.lstrip('*') # What does the * mean in ref IDs?
                  for n in record.iterfind('.//DescriptorUI')],
             )
@@ -209,3 +234,12 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
         if tree_types is None:
             tree_types = cls.tree_type_defaults
         return list(tree_types.values())
+
+
+def _parse_chunk(parse, chunk):
+    return list(parse(io.BytesIO(chunk)))
+
+
+def _unique(terms):
+    # Remove duplicates, but keep the order (unlike set()).
+    return tuple(dict.fromkeys(terms))
@@ -30,6 +30,7 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
     remote = 'ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdump.tar.gz'
     source_ref = 'https://www.ncbi.nlm.nih.gov/taxonomy'
     umls_abb = 'NCBI'
+    compact_key = 2  # rank
 
     def __init__(self, ranks='species', **kwargs):
         '''
@@ -42,7 +43,10 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
         self.valid_ranks = self._parse_rank_spec(ranks)
 
     def _cui_concepts(self):
-        for id_, cui, rank, pref, *terms in self._concept_rows():
+        # Only read the blocks of the selected ranks.
+        keys = None if isinstance(self.valid_ranks, Universe) \
+            else self.valid_ranks
+        for id_, cui, rank, pref, *terms in self._concept_rows(keys):
             if rank in self.valid_ranks:
                 yield id_, cui, pref, terms, self.entity_type, self.resource
 
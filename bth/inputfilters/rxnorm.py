@@ -15,11 +15,11 @@ Parse RxNorm Current Prescribable Content ("RXNCONSO.RRF").
 # RXNREL.RRF : atoms and concept links, links RXAUI and RXCUI
 
 
-import csv
-import codecs
 from collections import Counter
 
 from ._base import IterConceptRecordSet, UMLSIterConceptMixin
+from ..core import settings
+from ..lib.tools import iter_chunks, pool_imap
 
 
 class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
@@ -41,18 +41,40 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
     def _update_steps(cls):
         return ('zip', 'rrf/RXNCONSO.RRF', cls.preprocess)
 
+    # Number of concepts per batch for the worker processes.
+    batch_size = 10000
+
     @classmethod
     def preprocess(cls, stream):
         '''
         Parse RRF and produce lines in the canonical _iter_concepts format.
+
+        The concepts are grouped in the main process and then
+        processed in batches by parallel worker processes.
         '''
-        zip_to_text = codecs.iterdecode(stream, encoding='utf-8')
-        reader = csv.reader(zip_to_text, delimiter="|")
+        concepts = cls._prep_concepts(cls._split_rows(stream))
+        batches = iter_chunks(concepts, cls.batch_size)
+        for lines in pool_imap(cls._preprocess_batch, batches,
+                               settings.preprocess_workers):
+            yield from lines
+
+    @classmethod
+    def _preprocess_batch(cls, concepts):
         cui_map = cls._load_cui_map()
-        for id_, terms in cls._prep_concepts(reader):
+        lines = []
+        for id_, terms in concepts:
             pref = cls.preferred_term(terms)
             for cui, t in cls._assign_cuis(id_, set(terms), cui_map):
-                yield cls._canonical_line(id=id_, cui=cui, pref=pref, terms=t)
+                lines.append(cls._canonical_line(id=id_, cui=cui, pref=pref,
+                                                 terms=t))
+        return lines
+
+    @staticmethod
+    def _split_rows(lines):
+        # RRF has no quoting, so plain splitting is enough.
+        # Only the first 15 columns are needed: don't split the rest.
+        for line in lines:
+            yield line.decode('utf-8').split('|', 15)
 
     @staticmethod
     def _prep_concepts(rows):
@@ -70,7 +92,7 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
                 if terms:
                     yield id_, terms
                 id_ = row[0]
-                terms.clear()
+                terms = []
             terms.append(row[14])
         # Don't forget the last concept.
         if terms:
@@ -85,6 +107,8 @@ class RecordSet(UMLSIterConceptMixin, IterConceptRecordSet):
         Break ties first by preferring longer names, then by
         preferring title-cased names.
         '''
+        if len(terms) == 1:
+            return terms[0]
         frequencies = Counter(term.lower() for term in terms)
         def _sortkey(term):
             titlecase = sum(tok.istitle() for tok in term.split())
@@ -9,9 +9,14 @@ Collect UniProt proteins ("uniprot_sprot.xml").
 '''
 
 
+import io
+
 from lxml import etree
 
 from ._base import IterConceptRecordSet
+from ..core import settings
+from ..lib.tools import pool_imap
+from ..lib.xmlchunks import split_records
 
 
 class RecordSet(IterConceptRecordSet):
@@ -32,7 +37,21 @@ class RecordSet(IterConceptRecordSet):
     def preprocess(cls, stream):
         '''
         Extract the relevant information.
+
+        The XML is cut into chunks of complete <entry> elements,
+        which are parsed in parallel worker processes.
         '''
+        chunks = split_records(stream, 'entry')
+        for lines in pool_imap(cls._parse_chunk, chunks,
+                               settings.preprocess_workers):
+            yield from lines
+
+    @classmethod
+    def _parse_chunk(cls, chunk):
+        return list(cls._parse_entries(io.BytesIO(chunk)))
+
+    @classmethod
+    def _parse_entries(cls, stream):
         # Precompose the Xpaths including namespace.
         entry_tag = cls._ns('entry')
         id_tag = cls._ns('accession')
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Compact binary format for the canonical _iter_concepts dumps.
+
+File layout:
+    magic number (8 bytes)
+    blocks: length (uint32) + marshalled tuple of row tuples
+    index: marshalled tuple of (offset, keys) pairs, one per block
+    trailer: offset of the index (uint64)
+
+Within each block, repeated strings (eg. "CUI-less" or the
+rank/namespace columns) are interned before marshalling,
+which makes them a back-reference in the serialisation
+and a shared object after loading.
+Blocks can optionally be labeled with the set of keys
+(eg. ranks) occurring in their rows, such that readers
+can skip irrelevant blocks entirely.
+'''
+
+
+import os
+import mmap
+import struct
+import marshal
+
+from . import tools
+
+
+MAGIC = b'BTHdump2'
+BLOCK_SIZE = 1000  # rows per block (small blocks are more cache-friendly)
+
+_LENGTH = struct.Struct('<I')
+_TRAILER = struct.Struct('<Q')
+
+
+def path_for(fn):
+    '''
+    Path to the compact dump corresponding to this TSV.
+    '''
+    return fn + '.bin'
+
+
+def is_fresh(path, source):
+    '''
+    Is there a compact dump at least as recent as its source?
+
+    Files in an outdated format are considered stale,
+    such that they are recreated with the next update.
+    '''
+    if not tools.is_fresh(path, source):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write(rows, path, key=None):
+    '''
+    Serialise rows (sequences of str) to a compact dump.
+
+    If `key` is given, it is called on every row, and
+    each block is labeled with the set of its values.
+    '''
+    index = []
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        for block_keys, block in _iter_blocks(rows, key):
+            index.append((f.tell(), block_keys))
+            data = marshal.dumps(block)
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+        index_offset = f.tell()
+        f.write(marshal.dumps(tuple(index)))
+        f.write(_TRAILER.pack(index_offset))
+    os.rename(path + '.tmp', path)
+
+
+def _iter_blocks(rows, key):
+    interned = {}
+    block = []
+    for row in rows:
+        block.append(tuple(interned.setdefault(s, s) for s in row))
+        if len(block) >= BLOCK_SIZE:
+            yield _block_keys(block, key), tuple(block)
+            block.clear()
+            interned.clear()
+    if block:
+        yield _block_keys(block, key), tuple(block)
+
+
+def _block_keys(block, key):
+    if key is None:
+        return None
+    return frozenset(map(key, block))
+
+
+def read(path, keys=None):
+    '''
+    Iterate over the rows of a compact dump.
+
+    If `keys` is given, blocks without any of these keys
+    are skipped; the remaining rows still need filtering.
+    Unlabeled blocks are always read.
+    '''
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError('not a compact dump: {}'.format(path))
+            (index_offset,) = _TRAILER.unpack_from(mm, len(mm)-_TRAILER.size)
+            index = marshal.loads(mm[index_offset:len(mm)-_TRAILER.size])
+            for offset, block_keys in index:
+                if (keys is not None and block_keys is not None
+                        and block_keys.isdisjoint(keys)):
+                    continue
+                (length,) = _LENGTH.unpack_from(mm, offset)
+                start = offset + _LENGTH.size
+                yield from marshal.loads(mm[start:start+length])
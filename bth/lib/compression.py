@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Compress output streams in a background thread.
+'''
+
+
+import io
+import time
+import gzip
+import queue
+import zipfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Supported compression formats.
+FORMATS = ('gz', 'zip') + (('zst',) if zstandard is not None else ())
+
+# Number of buffered chunks waiting for compression.
+QUEUE_SIZE = 16
+
+# Size of the chunks passed to the compression thread.
+BUFFER_SIZE = 2**20  # Bytes
+
+
+def open_compressed(file, fmt, member=None):
+    '''
+    Open a binary file object that compresses in the background.
+
+    Args:
+        file (str or int): path or file descriptor of the target
+        fmt (str): any of FORMATS
+        member (str): archive member name (zip format only)
+
+    The writing thread fills a bounded queue, while a
+    separate thread compresses the chunks and writes them
+    to disk.
+    '''
+    if fmt not in FORMATS:
+        raise ValueError('unsupported compression format: {}'.format(fmt))
+    sink = _CompressingSink(open(file, 'wb'), fmt, member)
+    return io.BufferedWriter(sink, buffer_size=BUFFER_SIZE)
+
+
+class _CompressingSink(io.RawIOBase):
+    '''
+    Raw writer that passes all data to a compression thread.
+    '''
+    def __init__(self, target, fmt, member):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, args=(target, fmt, member), daemon=True)
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self._queue.put(None)
+            self._thread.join()
+        super().close()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self, target, fmt, member):
+        try:
+            with target, self._open(target, fmt, member) as f:
+                for chunk in iter(self._queue.get, None):
+                    f.write(chunk)
+        except Exception as e:
+            self._error = e
+            # Keep consuming, so the producer isn't blocked forever.
+            for _ in iter(self._queue.get, None):
+                pass
+
+    @staticmethod
+    def _open(target, fmt, member):
+        if fmt == 'gz':
+            return gzip.GzipFile(fileobj=target, mode='wb')
+        if fmt == 'zst':
+            return zstandard.ZstdCompressor().stream_writer(target)
+        # Zip: a single archive member (works also with unseekable targets).
+        return _ZipMember(target, member)
+
+
+class _ZipMember:
+    '''
+    Context manager for writing a single-member zip archive.
+    '''
+    def __init__(self, target, member):
+        self._archive = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+        info = zipfile.ZipInfo(member, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._member = self._archive.open(info, 'w', force_zip64=True)
+
+    def write(self, data):
+        '''Write to the archive member.'''
+        return self._member.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._member.close()
+        self._archive.close()
+        return False  # don't suppress exceptions
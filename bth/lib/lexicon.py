@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Binary word-frequency lexicon, sorted by frequency.
+
+File layout:
+    magic number (8 bytes)
+    number of entries N (uint64)
+    negated frequencies: N float64 (ascending, ie. most frequent first)
+    offsets: N+1 uint64 (end of each word in the blob, preceded by 0)
+    blob: UTF-8 words, each terminated by a newline
+
+The words above any frequency threshold form a prefix of
+the blob, which is found by binary search over the mmapped
+frequency column.
+'''
+
+
+import os
+import mmap
+import array
+import bisect
+import struct
+
+
+MAGIC = b'BTHlex01'
+
+_HEADER = struct.Struct('<8sQ')
+
+
+def write(entries, path):
+    '''
+    Write (word, frequency) pairs to a binary lexicon.
+    '''
+    entries = sorted(entries, key=lambda e: -e[1])
+    freqs = array.array('d', (-freq for _, freq in entries))
+    offsets = array.array('Q', [0])
+    blob = bytearray()
+    for word, _ in entries:
+        blob.extend(word.encode('utf8'))
+        blob.extend(b'\n')
+        offsets.append(len(blob))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(entries)))
+        freqs.tofile(f)
+        offsets.tofile(f)
+        f.write(blob)
+    os.rename(path + '.tmp', path)
+
+
+def frequent(path, threshold):
+    '''
+    Get all words with a frequency of at least `threshold`.
+    '''
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, n = _HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                raise ValueError('not a lexicon: {}'.format(path))
+            start = _HEADER.size
+            with memoryview(mm) as view:
+                freqs = view[start:start+8*n].cast('d')
+                count = bisect.bisect_right(freqs, -threshold)
+                start += 8*n
+                offsets = view[start:start+8*(n+1)].cast('Q')
+                end = offsets[count]
+                start += 8*(n+1)
+                words = str(view[start:start+end], 'utf8')
+                freqs.release()
+                offsets.release()
+    return words.split('\n')[:-1]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Compact set of string pairs, based on 64-bit hashes.
+
+Also: read-only on-disk mapping from string pairs to strings.
+'''
+
+
+import os
+import mmap
+import array
+import bisect
+import heapq
+import struct
+import hashlib
+import itertools as it
+
+
+def pair_hash(first, second):
+    '''
+    64-bit hash of a pair of strings.
+
+    Unlike hash(), the value is stable across processes.
+    '''
+    key = (first + '\t' + second).encode('utf8')
+    return int.from_bytes(_blake2b(key, digest_size=8).digest(), 'little')
+
+
+_blake2b = hashlib.blake2b
+
+# The hash array is partitioned into buckets by the leading bits,
+# which narrows down the binary search.
+_BUCKET_SHIFT = 48  # 16 bits: 65536 buckets
+
+# New members are sorted in runs of this size before merging.
+_RUN_SIZE = 2**18
+
+
+class PairHashSet:
+    '''
+    Set of (str, str) pairs, stored as a sorted array of hashes.
+
+    Each member takes 8 bytes, as opposed to several hundred
+    for a tuple of str in a set.
+    Membership tests can give false positives in case of
+    a hash collision, but this is very unlikely (for a
+    million pairs, the probability is around 1e-7).
+    '''
+    def __init__(self, pairs=()):
+        self._hashes = array.array('Q')
+        self._buckets = None
+        self._pending = array.array('Q', (pair_hash(*p) for p in pairs))
+
+    def add(self, pair):
+        '''
+        Add a pair to the set.
+        '''
+        self._pending.append(pair_hash(*pair))
+
+    def update(self, other):
+        '''
+        Add all members of another PairHashSet.
+        '''
+        other._consolidate()
+        if not self:
+            # Adopt the other array (no need to sort again).
+            self._hashes = array.array('Q', other._hashes)
+            self._buckets = None
+        else:
+            self._pending.extend(other._hashes)
+
+    def __contains__(self, pair):
+        self._consolidate()
+        h = pair_hash(*pair)
+        b = h >> _BUCKET_SHIFT
+        lo, hi = self._buckets[b], self._buckets[b+1]
+        i = bisect.bisect_left(self._hashes, h, lo, hi)
+        return i < hi and self._hashes[i] == h
+
+    def __len__(self):
+        self._consolidate()
+        return len(self._hashes)
+
+    def _consolidate(self):
+        # Merge any recently added members into the sorted array.
+        if self._pending:
+            # Sort the new members in runs (never holding more than
+            # a run as Python ints), then merge the sorted arrays
+            # and drop adjacent duplicates.
+            runs = [self._hashes]
+            for i in range(0, len(self._pending), _RUN_SIZE):
+                run = sorted(self._pending[i:i+_RUN_SIZE])
+                runs.append(array.array('Q', run))
+            self._pending = array.array('Q')
+            merged = heapq.merge(*runs)
+            self._hashes = array.array('Q', (h for h, _ in it.groupby(merged)))
+            self._buckets = None
+        if self._buckets is None:
+            # Start offset of each bucket, plus the end offset.
+            self._buckets = array.array('L', (
+                bisect.bisect_left(self._hashes, b << _BUCKET_SHIFT)
+                for b in range(2**(64-_BUCKET_SHIFT))))
+            self._buckets.append(len(self._hashes))
+
+    def save(self, path):
+        '''
+        Write the hash array to disk.
+        '''
+        self._consolidate()
+        # Concurrent jobs might be saving the same index,
+        # so each of them gets a unique temp file.
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                self._hashes.tofile(f)
+            os.rename(tmp, path)
+        finally:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Read a hash array written with save().
+        '''
+        new = cls()
+        with open(path, 'rb') as f:
+            new._hashes.frombytes(f.read())
+        return new
+
+
+class PairHashMap:
+    '''
+    Read-only mapping from (str, str) pairs to str, stored on disk.
+
+    The file is memory-mapped, so opening it is instantaneous
+    and the data are shared by all processes using it.
+    Keys are represented by their hash (see PairHashSet for
+    the probability of false positives); distinct values
+    are stored only once.
+
+    File layout:
+        magic number (8 bytes)
+        number of keys N, number of distinct values M (uint64)
+        bucket offsets: 2**16+1 uint64
+        key hashes: N uint64 (sorted)
+        value indices: N uint32 (padded to 8 bytes)
+        value offsets: M+1 uint64 (end of each value in the blob)
+        blob: UTF-8 values
+    '''
+
+    MAGIC = b'BTHphm01'
+    _HEADER = struct.Struct('<8sQQ')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, m = self._HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC:
+            raise ValueError('not a pair-hash map: {}'.format(path))
+        view = memoryview(self._mmap)
+        start = self._HEADER.size
+        sizes = [(2**(64-_BUCKET_SHIFT)+1, 'Q'), (n, 'Q'),
+                 (n + n%2, 'I'), (m+1, 'Q')]
+        arrays = []
+        for length, fmt in sizes:
+            end = start + length*struct.calcsize(fmt)
+            arrays.append(view[start:end].cast(fmt))
+            start = end
+        self._buckets, self._hashes, self._values, self._offsets = arrays
+        self._blob = view[start:]
+        self._views = [view, *arrays, self._blob]
+
+    @classmethod
+    def write(cls, items, path):
+        '''
+        Create a map file from ((str, str), str) pairs.
+        '''
+        values = {}
+        entries = sorted((pair_hash(*pair), values.setdefault(v, len(values)))
+                         for pair, v in items)
+        hashes = array.array('Q', (h for h, _ in entries))
+        indices = array.array('I', (i for _, i in entries))
+        if len(indices) % 2:
+            indices.append(0)  # padding
+        buckets = array.array('Q', (
+            bisect.bisect_left(hashes, b << _BUCKET_SHIFT)
+            for b in range(2**(64-_BUCKET_SHIFT))))
+        buckets.append(len(hashes))
+        offsets = array.array('Q', [0])
+        blob = bytearray()
+        for value in values:
+            blob.extend(value.encode('utf8'))
+            offsets.append(len(blob))
+        # Concurrent processes might be creating the same map.
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, len(hashes), len(values)))
+            for a in (buckets, hashes, indices, offsets):
+                a.tofile(f)
+            f.write(blob)
+        os.rename(tmp, path)
+
+    def get(self, pair, default=None):
+        '''
+        Look up the value for this pair.
+        '''
+        h = pair_hash(*pair)
+        b = h >> _BUCKET_SHIFT
+        lo, hi = self._buckets[b], self._buckets[b+1]
+        i = bisect.bisect_left(self._hashes, h, lo, hi)
+        if i == hi or self._hashes[i] != h:
+            return default
+        v = self._values[i]
+        return str(self._blob[self._offsets[v]:self._offsets[v+1]], 'utf8')
+
+    def __getitem__(self, pair):
+        value = self.get(pair)
+        if value is None:
+            raise KeyError(pair)
+        return value
+
+    def __contains__(self, pair):
+        return self.get(pair) is not None
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def close(self):
+        '''
+        Release the memory map.
+        '''
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Read streams and iterators ahead in a background thread.
+'''
+
+
+import io
+import queue
+import threading
+
+
+# Size of the chunks read from binary streams.
+BUFFER_SIZE = 2**20  # Bytes
+
+# Number of items per queue entry when reading iterators.
+BATCH_SIZE = 1000
+
+
+def prefetch(source, maxsize=16):
+    '''
+    Consume `source` in a background thread.
+
+    Args:
+        source: a binary file object or an iterator
+        maxsize (int): number of buffered chunks/batches
+
+    Return a context manager, which gives a binary
+    file object or an iterator, respectively.
+    Other objects (eg. lists) are passed through.
+    On exit, the background thread is stopped.
+    '''
+    if hasattr(source, 'read'):
+        return _Prefetcher(_read_chunks(source), maxsize, _queue_stream)
+    if iter(source) is source:
+        return _Prefetcher(_batches(source), maxsize, _unbatch)
+    return _Passthrough(source)
+
+
+def _read_chunks(stream):
+    while True:
+        chunk = stream.read(BUFFER_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _batches(iterator):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _unbatch(entries):
+    for batch in entries:
+        yield from batch
+
+
+class _Prefetcher:
+    '''
+    Context manager for a producer thread feeding a bounded queue.
+    '''
+    def __init__(self, entries, maxsize, wrapper):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._error = None
+        self._wrapper = wrapper
+        self._thread = threading.Thread(
+            target=self._run, args=(entries,), daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self._wrapper(self._entries())
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Unblock the producer, in case it wasn't consumed completely.
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        return False  # don't suppress exceptions
+
+    def _run(self, entries):
+        try:
+            for entry in entries:
+                if self._stop.is_set():
+                    return
+                self._queue.put(entry)
+        except Exception as e:
+            self._error = e
+        self._queue.put(None)
+
+    def _entries(self):
+        for entry in iter(self._queue.get, None):
+            yield entry
+        if self._error is not None:
+            raise self._error
+
+
+class _Passthrough:
+    '''
+    Dummy context manager.
+    '''
+    def __init__(self, source):
+        self._source = source
+
+    def __enter__(self):
+        return self._source
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False  # don't suppress exceptions
+
+
+def _queue_stream(chunks):
+    return io.BufferedReader(_QueueReader(chunks), buffer_size=BUFFER_SIZE)
+
+
+class _QueueReader(io.RawIOBase):
+    '''
+    Raw reader that takes its data from an iterator of chunks.
+    '''
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = chunks
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._pending:
+            self._pending = memoryview(next(self._chunks, b''))
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
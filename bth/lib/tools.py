@@ -10,11 +10,17 @@ Miscellaneous helper tools.
 '''
 
 
+import os
 import re
 import csv
+import fcntl
+import pickle
 import logging
+import itertools as it
+import multiprocessing as mp
 from pathlib import Path
-from collections import namedtuple
+from collections import namedtuple, deque
+from contextlib import contextmanager
 
 
 # Special value for the `idprefix` parameter: make all IDs URIs.
@@ -26,6 +32,81 @@ Fields = namedtuple('Fields', 'cui resource original_id '
                               'term preferred_term entity_type')
 
 
+class RowBatch:
+    '''
+    Columnar representation of a sequence of rows.
+
+    Each field of Fields is stored in a separate list.
+    Values repeated across rows (eg. the CUI, resource,
+    preferred term and entity type of all synonyms of a
+    concept) are shared references.
+    Iterating gives Fields tuples, for compatibility.
+    '''
+
+    __slots__ = ('columns',)
+
+    def __init__(self, columns=None):
+        if columns is None:
+            columns = tuple([] for _ in Fields._fields)
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''
+        Create a batch from an iterable of rows.
+        '''
+        batch = cls()
+        batch.extend(rows)
+        return batch
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        return map(Fields._make, self.tuples())
+
+    def tuples(self):
+        '''
+        Iterate over the rows as plain tuples.
+        '''
+        return zip(*self.columns)
+
+    def column(self, field):
+        '''
+        Get the list of values for this field name.
+        '''
+        return self.columns[Fields._fields.index(field)]
+
+    def select(self, mask):
+        '''
+        Create a new batch with the rows flagged in mask.
+        '''
+        mask = list(mask)
+        return RowBatch(tuple(list(it.compress(c, mask))
+                              for c in self.columns))
+
+    def extend(self, rows):
+        '''
+        Append rows (sequences of six values).
+        '''
+        for column, values in zip(self.columns, zip(*rows)):
+            column.extend(values)
+
+    def add_synonyms(self, cui, resource, id_, terms, pref, entity_type):
+        '''
+        Append one row per term, sharing the other values.
+        '''
+        cuis, resources, ids, all_terms, prefs, types = self.columns
+        n = len(all_terms)
+        all_terms.extend(terms)
+        n = len(all_terms) - n
+        cuis.extend([cui]*n)
+        resources.extend([resource]*n)
+        ids.extend([id_]*n)
+        prefs.extend([pref]*n)
+        types.extend([entity_type]*n)
+
+
 class TSVDialect(csv.Dialect):
     'TSV dialect used for the Hub output.'
     lineterminator = '\r\n'
@@ -45,6 +126,131 @@ def sanitise(text):
     return re.sub(r'[^a-zA-Z0-9]', '', text)
 
 
+def iter_chunks(iterable, size):
+    '''
+    Split an iterable into lists of (at most) `size` elements.
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(it.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def spool_batches(batches, path):
+    '''
+    Write RowBatch objects to a file.
+    '''
+    with open(path, 'wb') as f:
+        for _ in tee_spool(batches, f):
+            pass
+    return path
+
+
+def tee_spool(batches, file):
+    '''
+    Pass through row batches while spooling them to an open file.
+    '''
+    for batch in batches:
+        # Pickling memoizes the shared values of a RowBatch.
+        pickle.dump(batch, file, pickle.HIGHEST_PROTOCOL)
+        yield batch
+
+
+def read_batches(path):
+    '''
+    Iterate over the batches of a spool file as RowBatch objects.
+    '''
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield batch
+
+
+def pool_imap(func, iterable, workers=1):
+    '''
+    Lazy, order-preserving map() in worker processes.
+
+    Unlike Pool.imap, the input is consumed only a few
+    items ahead of the output, which keeps memory bounded
+    for large inputs.
+    With a single worker, or inside a daemonic process
+    (eg. a worker of another pool, which can't have
+    children), the builtin map() is used.
+    '''
+    if workers <= 1 or mp.current_process().daemon:
+        yield from map(func, iterable)
+        return
+    if _shared_pool is not None:
+        yield from _pool_imap(_shared_pool, func, iterable, workers)
+        return
+    with mp.Pool(workers) as pool:
+        yield from _pool_imap(pool, func, iterable, workers)
+
+
+def _pool_imap(pool, func, iterable, workers):
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= 2*workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+_shared_pool = None
+
+
+@contextmanager
+def shared_pool(workers=1):
+    '''
+    Make pool_imap use a single process pool within this block.
+
+    This is needed when pool_imap is called from several
+    threads: forking worker processes from a multi-threaded
+    process can deadlock, and each thread would start its
+    own set of workers.
+    Enter this block before starting the threads.
+    '''
+    global _shared_pool
+    if workers <= 1 or mp.current_process().daemon:
+        yield  # pool_imap uses map() anyway
+        return
+    with mp.Pool(workers) as pool:
+        _shared_pool = pool
+        try:
+            yield
+        finally:
+            _shared_pool = None
+
+
+def is_fresh(path, source):
+    '''
+    Is there a file at path at least as recent as source?
+    '''
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source)
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def locked(path, mode='rb'):
+    '''
+    Open a file and hold an exclusive (advisory) lock on it.
+
+    The lock is respected by other threads and processes
+    using this function on the same path.
+    '''
+    with open(path, mode) as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield f
+
+
 class classproperty(property):
     '''Decorator for class properties.'''
     def __get__(self, _instance, owner):
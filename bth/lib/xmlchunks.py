@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Split large XML documents into smaller ones at record boundaries.
+
+This allows parsing the records in parallel processes.
+'''
+
+
+import re
+
+
+# Approximate size of the chunks.
+CHUNK_SIZE = 2**22  # Bytes
+
+_TAG = re.compile(rb'<(/?)([^\s>/?!]+)[^>]*?(/?)>')
+
+
+def split_records(stream, tag, size=CHUNK_SIZE):
+    '''
+    Cut an XML document into well-formed parts.
+
+    Each part contains a sequence of complete `tag` elements
+    of roughly `size` bytes, wrapped in the original prolog
+    and ancestor elements (everything before the first record)
+    and matching end tags.
+    Anything between the last record and the end of the
+    enclosing element is kept in the last part.
+    The records must not be nested in each other.
+    '''
+    boundary = re.compile(b'<' + re.escape(tag.encode('utf8')) + rb'[\s>/]')
+    buffer = b''
+    header = None
+    for block in iter(lambda: stream.read(size), b''):
+        buffer += block
+        if header is None:
+            match = boundary.search(buffer)
+            if match is None:
+                continue
+            header, buffer = buffer[:match.start()], buffer[match.start():]
+            open_tags = _open_tags(header)
+            footer = b''.join(b'</%s>' % t for t in reversed(open_tags))
+        # Cut before the last record start tag, which is probably incomplete.
+        cut = max((m.start() for m in boundary.finditer(buffer, 1)),
+                  default=0)
+        if cut:
+            yield b''.join((header, buffer[:cut], footer))
+            buffer = buffer[cut:]
+    if header is not None:
+        if open_tags:
+            # Remove the end tags of the ancestors.
+            end = buffer.rfind(b'</' + open_tags[-1])
+            if end != -1:
+                buffer = buffer[:end]
+        yield b''.join((header, buffer, footer))
+
+
+def _open_tags(header):
+    stack = []
+    for closing, name, empty in _TAG.findall(header):
+        if closing:
+            stack.pop()
+        elif not empty:
+            stack.append(name)
+    return stack
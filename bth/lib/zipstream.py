@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Sequential reading of zip archives from unseekable streams.
+
+Unlike zipfile.ZipFile, the central directory at the end
+of the archive is not used.  Instead, the members are read
+in archive order, based on their local file headers.
+This works for stored and deflated members, as long as
+the compressed size is given in the local header (or the
+member is deflated, which makes its end detectable).
+'''
+
+
+import io
+import zlib
+import struct
+
+
+STORED = 0
+DEFLATED = 8
+
+_LOCAL_SIG = b'PK\x03\x04'
+_DESCRIPTOR_SIG = b'PK\x07\x08'
+
+# Local file header (after the signature).
+_LOCAL_HEADER = struct.Struct('<HHHHHIIIHH')
+
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_ZIP64_EXTRA = 0x0001
+
+# Size of compressed chunks read from the stream.
+CHUNK_SIZE = 2**16
+
+
+def iter_members(stream):
+    '''
+    Iterate over the members of a zip archive.
+
+    Yield pairs <name, file object>.
+    Each file object must be consumed before proceeding
+    to the next member; any unread data is skipped (and
+    checked for integrity) when the iteration continues.
+    Members that weren't read at all are skipped without
+    decompressing them, if their size is known.
+    '''
+    source = _Source(stream)
+    while True:
+        sig = source.read(4)
+        if sig != _LOCAL_SIG:
+            # Central directory reached (or end of stream).
+            break
+        (_, flags, method, _, _, crc, csize, usize, name_len, extra_len
+         ) = _LOCAL_HEADER.unpack(source.read_exact(_LOCAL_HEADER.size))
+        name = source.read_exact(name_len)
+        name = name.decode('utf8' if flags & _FLAG_UTF8 else 'cp437')
+        zip64 = _zip64_sizes(source.read_exact(extra_len))
+        if zip64 is not None:
+            usize, csize = zip64
+        if flags & _FLAG_ENCRYPTED:
+            raise ValueError('encrypted member: {}'.format(name))
+        if method not in (STORED, DEFLATED):
+            raise ValueError('unsupported compression method {}: {}'
+                             .format(method, name))
+        if flags & _FLAG_DESCRIPTOR:
+            if method == STORED:
+                raise ValueError('cannot find the end of a stored member '
+                                 'without size: {}'.format(name))
+            csize = None
+        member = _MemberReader(source, name, method, csize)
+        yield name, io.BufferedReader(member, buffer_size=CHUNK_SIZE)
+        if not member.started and csize is not None:
+            source.skip(csize)
+            continue
+        member.finish()
+        if flags & _FLAG_DESCRIPTOR:
+            crc = _read_descriptor(source, zip64 is not None)
+        if member.crc != crc:
+            raise ValueError('CRC mismatch: {}'.format(name))
+
+
+def _zip64_sizes(extra):
+    # Find the sizes in the Zip64 extended information field, if present.
+    offset = 0
+    while offset + 4 <= len(extra):
+        tag, size = struct.unpack_from('<HH', extra, offset)
+        offset += 4
+        if tag == _ZIP64_EXTRA and size >= 16:
+            return struct.unpack_from('<QQ', extra, offset)
+        offset += size
+    return None
+
+
+def _read_descriptor(source, zip64):
+    # The signature is optional.
+    crc = source.read_exact(4)
+    if crc == _DESCRIPTOR_SIG:
+        crc = source.read_exact(4)
+    source.read_exact(16 if zip64 else 8)  # sizes: not needed
+    return struct.unpack('<I', crc)[0]
+
+
+class _Source:
+    '''
+    Stream wrapper with push-back.
+    '''
+    def __init__(self, stream):
+        self._stream = stream
+        self._pushback = b''
+
+    def read(self, n):
+        '''Read up to n bytes.'''
+        if self._pushback:
+            chunk = self._pushback[:n]
+            self._pushback = self._pushback[n:]
+            return chunk
+        return self._stream.read(n)
+
+    def read_exact(self, n):
+        '''Read exactly n bytes.'''
+        data = b''
+        while len(data) < n:
+            chunk = self.read(n-len(data))
+            if not chunk:
+                raise EOFError('truncated zip archive')
+            data += chunk
+        return data
+
+    def skip(self, n):
+        '''Discard n bytes.'''
+        while n > 0:
+            chunk = self.read(min(n, CHUNK_SIZE))
+            if not chunk:
+                raise EOFError('truncated zip archive')
+            n -= len(chunk)
+
+    def unread(self, data):
+        '''Put data back to the front of the stream.'''
+        self._pushback = data + self._pushback
+
+
+class _MemberReader(io.RawIOBase):
+    '''
+    Raw reader for the decompressed data of one member.
+    '''
+    def __init__(self, source, name, method, size):
+        super().__init__()
+        self.name = name
+        self.crc = 0
+        self.started = False
+        self._source = source
+        self._remaining = size  # None: unknown (deflated)
+        self._inflater = zlib.decompressobj(-zlib.MAX_WBITS) \
+            if method == DEFLATED else None
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        self.started = True
+        while not self._eof:
+            data = self._next(len(b))
+            if data:
+                n = len(data)
+                b[:n] = data
+                self.crc = zlib.crc32(data, self.crc)
+                return n
+        return 0
+
+    def finish(self):
+        '''Skip any unread data.'''
+        buffer = bytearray(CHUNK_SIZE)
+        while self.readinto(buffer):
+            pass
+
+    def _next(self, n):
+        if self._inflater is None:
+            data = self._raw(n)
+            if not data:
+                self._eof = True
+            return data
+        inflater = self._inflater
+        if inflater.eof:
+            # Give back what belongs to the next header.
+            self._source.unread(inflater.unused_data)
+            self._eof = True
+            return b''
+        data = inflater.unconsumed_tail or self._raw(CHUNK_SIZE)
+        if not data:
+            raise EOFError('truncated zip member: {}'.format(self.name))
+        return inflater.decompress(data, n)
+
+    def _raw(self, n):
+        if self._remaining is None:
+            return self._source.read(n)
+        n = min(n, self._remaining)
+        data = self._source.read(n)
+        if n and not data:
+            raise EOFError('truncated zip member: {}'.format(self.name))
+        self._remaining -= len(data)
+        return data
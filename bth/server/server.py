@@ -11,6 +11,7 @@ Web server for the Bio Term Hub.
 
 import sys
 import os
+import io
 import threading
 import multiprocessing as mp
 import time
@@ -29,7 +30,7 @@ from bottle import Bottle, request, response, static_file, FormsDict
 from ..core import settings
 from ..core.aggregate import RecordSetContainer
 from ..inputfilters import FILTERS
-from ..update.fetch_remote import RemoteChecker
+from ..update.fetch_remote import RemoteChecker, check_all
 from ..stats.bgplotter import BGPlotter
 from ..lib.postfilters import RegexFilter
 from ..lib.base36gen import Base36Generator
@@ -138,6 +139,12 @@ def _api(app, manager):
         logging.debug('Serve static file: %s', path)
         return static_file(path, root=str(DOWNLOADDIR))
 
+    @app.get('/check')
+    def _check_all():
+        logging.debug('Check request: all')
+        msg, status = check_all_request()
+        return serialise(msg, status=status)
+
     @app.get('/check/<name>')
     def _check(name):
         logging.debug('Check request: %s', name)
@@ -207,7 +214,8 @@ def termlist_request(params, callback):
             flags=params.getlist('flags'),
             mapping=parse_renaming(params),
             idprefix=params.get('idprefix'),
-            postfilter=params.get('postfilter') and REGEXFILTER)
+            postfilter=params.get('postfilter') and REGEXFILTER,
+            cache=True)
         job_id = job_hash(rsc)
 
         plot_stats = params.get('plot-stats')
@@ -237,6 +245,24 @@ def check_request(name):
     return msg, status
 
 
+def check_all_request():
+    '''
+    Check all resources for remote changes at once.
+
+    The outcome is recorded in the stat logs, such that
+    subsequent check requests for a single resource don't
+    need to contact the remote again.
+    '''
+    remotes = [RemoteChecker(name) for name in FILTERS]
+    messages = {True: 'Update available.',
+                False: 'Up-to-date.',
+                None: 'Check failed.'}
+    div = etree.Element('div')
+    for remote, answer in zip(remotes, check_all(remotes)):
+        se(div, 'p', id=remote.name).text = messages[answer]
+    return div, '200 OK'
+
+
 def update_request(name):
     '''
     Update a resource from remote.
@@ -351,7 +377,7 @@ def populate_checkboxes(doc, resources):
     tbl.remove(tbl[0])  # remove the (now empty) first row.
     # Add a checkbox for the CTD-lookup flag.
     labels = ('skip CTD entries that are MeSH duplicates',
-              '(has no effect unless both CTD and MeSH are selected)')
+              '(has no effect unless CTD is selected)')
     checkbox_par(tbl.getparent(), labels, name='flags', value='ctd_lookup')
     # Add another checkbox for removing short terms.
     label = 'remove very short terms (1 or 2 characters) and plain numbers'
@@ -479,7 +505,7 @@ def handle_download_request(job_id, zipped, just_started):
     path = termlist_path(job_id)
     zpath = zipname(path)
     lpath = logname(path)
-    tpath = Tempfile(path).tmp
+    tpaths = [Tempfile(p).tmp for p in (path, zpath)]
     if zipped and zpath.exists():
         success_msg(msg, zpath)
     elif not zipped and path.exists():
@@ -488,7 +514,7 @@ def handle_download_request(job_id, zipped, just_started):
         with lpath.open('r', encoding='utf8') as f:
             msg.text = 'Runtime error: {}'.format(f.read())
         status = '500 Internal Server Error'
-    elif tpath.exists() or just_started:
+    elif any(p.exists() for p in tpaths) or just_started:
         msg.text = job_id
         status = '202 Accepted'
     else:
@@ -556,17 +582,25 @@ def create_resource(resources,
         else:
             stats = BGPlotter(plot_dir, proc_type=threading.Thread)
 
+    # Zip archives are compressed on the fly during aggregation,
+    # unless the plain termlist exists already.
+    if zipped and not target_fn.exists():
+        target, compression = zipname(target_fn), 'zip'
+    else:
+        target, compression = target_fn, None
+
     # Check if we really have to create this resource
     # (it might already exist from an earlier job).
-    if target_fn.exists():
+    if target.exists():
         # Touch this file to keep it from being cleaned away.
-        target_fn.touch()
+        target.touch()
         if stats:
-            stats.from_disk(target_fn)
+            stats_from_disk(stats, target, target_fn.name)
     else:
         try:
-            with Tempfile(target_fn) as tmp:
-                resources.write_tsv(str(tmp), stats=stats)
+            with Tempfile(target) as tmp:
+                resources.write_tsv(str(tmp), compression=compression,
+                                    member=target_fn.name, stats=stats)
         except Exception:
             logging.exception('Resource creation failed:')
             if log_exception:
@@ -605,3 +639,15 @@ def create_resource(resources,
     clean_up_dir(DOWNLOADDIR)
 
     return
+
+
+def stats_from_disk(stats, path, member):
+    '''
+    Create the plots from an existing termlist (plain or zipped).
+    '''
+    if path.suffix != '.zip':
+        stats.from_disk(path)
+        return
+    with zipfile.ZipFile(str(path)) as z:
+        with z.open(member) as f:
+            stats.from_file(io.TextIOWrapper(f, encoding='utf8'))
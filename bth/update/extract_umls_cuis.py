@@ -9,19 +9,26 @@ Extract UMLS entries for target resources.
 '''
 
 
+import os
 import io
+import re
 import csv
 import gzip
-import codecs
+import shutil
+import struct
 import zipfile
 import logging
 import argparse
+import tempfile
+import contextlib
 from pathlib import Path
 
 from ..core import settings
 from ..inputfilters import FILTERS
+from ..inputfilters._base import UMLSIterConceptMixin
 from .fetch_umls import fetch_full_release, predict_release
-from ..lib.tools import quiet_option, setup_logging
+from ..lib.tools import quiet_option, setup_logging, pool_imap
+from ..lib import zipstream
 
 
 DEFAULT_SOURCES = {rec.umls_abb: Path(rec.umls_dump_fn())
@@ -55,6 +62,10 @@ def main():
     ap.add_argument(
         '-t', '--target-dir', metavar='PATH',
         help='directory for saving extracted TSV files')
+    ap.add_argument(
+        '-j', '--jobs', type=int, metavar='N', dest='workers',
+        default=settings.preprocess_workers,
+        help='process MRCONSO fragments in N parallel processes')
     quiet_option(ap)
     args = vars(ap.parse_args())
     setup_logging(args.pop('quiet'))
@@ -70,7 +81,8 @@ def fetch_extract(fetch_umls, umls_full_zip, **kwargs):
     extract_targets(umls_full_zip, **kwargs)
 
 
-def extract_targets(umls_full_zip, sources=DEFAULT_SOURCES, target_dir=None):
+def extract_targets(umls_full_zip, sources=DEFAULT_SOURCES, target_dir=None,
+                    workers=1):
     '''
     Extract target entries into a separate TSV per resource.
     '''
@@ -80,22 +92,58 @@ def extract_targets(umls_full_zip, sources=DEFAULT_SOURCES, target_dir=None):
         sources = {sab: target_dir/'{}.tsv'.format(sab) for sab in sources}
     elif not isinstance(sources, dict):
         sources = {sab: DEFAULT_SOURCES[sab] for sab in sources}
-    _extract_targets(umls_full_zip, sources)
-
-
-def _extract_targets(umls_full_zip, sources):
-    files = []
+    _extract_targets(umls_full_zip, sources, workers)
+    for path in sources.values():
+        UMLSIterConceptMixin.index_cui_map(
+            str(path), str(path.with_suffix('.idx')))
+
+
+def _extract_targets(umls_full_zip, sources, workers=1):
+    # The MRCONSO fragments are filtered in parallel, each writing to
+    # a separate file per SAB, which are concatenated in the end.
+    # Each task covers one fragment, or all fragments of a compressed
+    # .nlm archive, which can only be read sequentially.
+    # The lines spanning a fragment boundary are processed here.
+    files = {}
     writers = {}
     for sab, path in sources.items():
         logging.info('Writing to %s', path)
-        files.append(path.open('w', encoding='utf-8'))
-        writers[sab] = csv.writer(files[-1], delimiter='\t', quotechar=None)
+        files[sab] = path.open('w', encoding='utf-8')
+        writers[sab] = _tsv_writer(files[sab])
+
+    tmpdir = tempfile.TemporaryDirectory(
+        dir=str(next(iter(sources.values())).parent))
+    with tmpdir:
+        tasks = [(umls_full_zip, nlm, fragments, sorted(sources),
+                  os.path.join(tmpdir.name, str(i)))
+                 for i, (nlm, fragments)
+                 in enumerate(iterfragments(umls_full_zip))]
+        last = b''  # partial line
+        for results in pool_imap(_filter_fragments, tasks, workers):
+            for head, tail, parts in results:
+                last += head
+                if tail is None:
+                    # No line break in this fragment.
+                    continue
+                for sab, *entry in parseconso([last.decode('utf-8')],
+                                              sources):
+                    writers[sab].writerow(entry)
+                for sab, part in parts.items():
+                    with open(part, encoding='utf-8', newline='') as f:
+                        shutil.copyfileobj(f, files[sab])
+                    os.remove(part)
+                last = tail
+        # Don't forget the very last line.
+        if last:
+            for sab, *entry in parseconso([last.decode('utf-8')], sources):
+                writers[sab].writerow(entry)
+
+    for f in files.values():
+        f.close()
 
-    for sab, *entry in iterentries(umls_full_zip, sources):
-        writers[sab].writerow(entry)
 
-    for f in files:
-        f.close()
+def _tsv_writer(f):
+    return csv.writer(f, delimiter='\t', quotechar=None)
 
 
 def find_umls_zip():
@@ -106,78 +154,179 @@ def find_umls_zip():
     return max(map(str, p.glob('umls-*-full.zip')), default=None)
 
 
-def iterentries(umls_full_zip, sources):
-    '''
-    Iterate over SAB/CUI/CODE/STR entries.
+def iterfragments(umls_full_zip):
     '''
-    conso = concatconso(umls_full_zip)
-    return parseconso(conso, sources)
-
-
-def concatconso(umls_full_zip):
+    Find the fragments of the MRCONSO table.
+
+    Iterate over pairs <.nlm archive, fragment names>.
+    Only the central directories are read.
+    If an inner archive is compressed in the full archive,
+    its central directory can't be reached without
+    decompressing it; in this case, the fragment names
+    are None (ie. all fragments, found when reading).
     '''
-    Line-iterate over the concatenated fragments of the MRCONSO table.
+    logging.info('Searching %s', umls_full_zip)
+    with zipfile.ZipFile(umls_full_zip) as full:
+        nlms = [info for info in full.infolist()
+                if info.filename.endswith('.nlm')]
+    for info in nlms:
+        with _open_stored(umls_full_zip, info) as stored:
+            if stored is None:
+                yield info.filename, None
+                continue
+            with zipfile.ZipFile(stored) as nlm:
+                for name in nlm.namelist():
+                    if _is_conso(name):
+                        yield info.filename, (name,)
+
+
+def iterconso(umls_full_zip, nlm_name, fragments=None):
     '''
-    # Concatenate binary line buffers before decoding -- in case a multi-byte
-    # UTF-8 character is split apart.
-    return codecs.iterdecode(_concatconso(umls_full_zip), 'utf-8')
+    Iterate over decompressed MRCONSO fragments as binary streams.
 
+    If fragments is None, all fragments of the inner
+    archive are read.
+    '''
+    with zipfile.ZipFile(umls_full_zip) as full:
+        info = full.getinfo(nlm_name)
+        with _open_stored(umls_full_zip, info) as stored:
+            if stored is not None:
+                # Random access through the inner central directory.
+                with zipfile.ZipFile(stored) as nlm:
+                    if fragments is None:
+                        fragments = list(filter(_is_conso, nlm.namelist()))
+                    for name in fragments:
+                        logging.info('Reading %s', name)
+                        with nlm.open(name) as f:
+                            with gzip.open(f, mode='rb') as conso:
+                                yield conso
+                return
+        with full.open(info) as nlm:
+            # Read the inner archive sequentially, without decompressing
+            # it to a seekable file first.
+            for name, f in zipstream.iter_members(nlm):
+                if _is_conso(name) and (fragments is None
+                                        or name in fragments):
+                    logging.info('Reading %s', name)
+                    with gzip.open(f, mode='rb') as conso:
+                        yield conso
 
-def _concatconso(umls_full_zip):
-    # The original table is not necessarily split at the end of a line.
-    # Therefore, iteration is delayed by one step, in order to hold back the
-    # last line of every fragment.  Once the next fragment is opened, the last
-    # seen line is checked for a trailing newline; if this fails, it is joined
-    # with the next line.
-    last = b''  # treat the beginning like a partial line to forward the iterator
-    # Iterate over fragments.
-    for nlm in iternlm(umls_full_zip):
-        for conso in iterconsofragments(nlm):
-            # If last is a partial line, forward the iterator without yielding.
-            if not last.endswith((b'\n', b'\r\n')):
-                try:
-                    current = next(conso)
-                except StopIteration:
-                    break
-                last += current
 
-            # Iterate over lines, delayed by one step.
-            for current in conso:
-                yield last
-                last = current
+def _is_conso(name):
+    return name.split('/')[-1].startswith('MRCONSO')
 
-    # Don't forget the very last line.
-    if last:
-        yield last
 
+@contextlib.contextmanager
+def _open_stored(path, info):
+    '''
+    Open an uncompressed member of a zip archive as a seekable file.
 
-def iternlm(umls_full_zip):
+    For compressed members, None is given.
     '''
-    Find the inner archives (zip files with .nlm extension).
+    if info.compress_type != zipfile.ZIP_STORED:
+        yield None
+        return
+    with open(path, 'rb') as f:
+        # The data start after the local header, whose extra field
+        # can differ from the one in the central directory.
+        f.seek(info.header_offset)
+        header = f.read(zipfile.sizeFileHeader)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        start = info.header_offset + len(header) + name_len + extra_len
+        yield io.BufferedReader(_Window(f, start, info.file_size), 2**20)
+
+
+class _Window(io.RawIOBase):
     '''
-    logging.info('Searching %s', umls_full_zip)
-    with zipfile.ZipFile(umls_full_zip) as full:
-        for info in full.infolist():
-            if info.filename.endswith('.nlm'):
-                logging.info('Extracting %s', info.filename)
-                with full.open(info) as nlm:
-                    if not nlm.seekable():
-                        # Read the archive into memory to get a seekable file.
-                        nlm = io.BytesIO(nlm.read())
-                    yield nlm
+    Seekable reader for a section of a file.
+    '''
+    def __init__(self, f, start, size):
+        super().__init__()
+        self._file = f
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, b):
+        n = max(min(len(b), self._size-self._pos), 0)
+        self._file.seek(self._start+self._pos)
+        n = self._file.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+
+def _filter_fragments(task):
+    '''
+    Extract the target entries of the MRCONSO fragments of one task.
+
+    Return a list with the result of _filter_fragment
+    for each fragment.
+    '''
+    umls_full_zip, nlm_name, fragments, sources, prefix = task
+    fragments = iterconso(umls_full_zip, nlm_name, fragments)
+    return [_filter_fragment(conso, sources, '{}.{}'.format(prefix, i))
+            for i, conso in enumerate(fragments)]
 
 
-def iterconsofragments(nlm):
+def _filter_fragment(conso, sources, prefix):
     '''
-    Find the MRCONSO table fragment(s) in a .nlm archive.
+    Extract the target entries of one MRCONSO fragment.
+
+    The original table is not necessarily split at the end
+    of a line.  Therefore, the first line and a trailing
+    partial line are returned unprocessed, such that they
+    can be joined with the neighbouring fragments.
+    The entries of all lines in between are written to a
+    separate TSV file per SAB.
+
+    Return the first line, the trailing partial line (None
+    if there is no line break at all), and the paths of
+    the TSV files by SAB.
     '''
-    with zipfile.ZipFile(nlm) as inner:
-        for info in inner.infolist():
-            if info.filename.split('/')[-1].startswith('MRCONSO'):
-                logging.info('Reading %s', info.filename)
-                with inner.open(info) as f:
-                    with gzip.open(f, mode='rb') as conso:
-                        yield conso
+    # Cheap pre-selection of lines before CSV parsing.
+    prefilter = re.compile(b'\\|(?:%s)\\|' % b'|'.join(
+        re.escape(sab.encode('utf-8')) for sab in sources)).search
+    tail = []
+    def _candidates(lines):
+        for line in lines:
+            if not line.endswith(b'\n'):
+                tail.append(line)  # can only be the last one
+            elif prefilter(line):
+                yield line.decode('utf-8')
+
+    head = conso.readline()
+    if not head.endswith(b'\n'):
+        return head, None, {}
+    files = {}
+    writers = {}
+    try:
+        for sab, *entry in parseconso(_candidates(conso), sources):
+            if sab not in writers:
+                files[sab] = open('{}.{}.tsv'.format(prefix, sab), 'w',
+                                  encoding='utf-8')
+                writers[sab] = _tsv_writer(files[sab])
+            writers[sab].writerow(entry)
+    finally:
+        for f in files.values():
+            f.close()
+    return head, b''.join(tail), {sab: f.name for sab, f in files.items()}
 
 
 def parseconso(stream, sources):
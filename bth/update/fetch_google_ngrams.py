@@ -19,6 +19,7 @@ from collections import namedtuple
 
 from ..core import settings
 from ..lib.tools import TSVDialect, quiet_option, setup_logging
+from ..lib import lexicon
 
 
 UNIGRAM_URL = ("http://storage.googleapis.com/books/ngrams/books/"
@@ -37,21 +38,29 @@ def main():
     ap = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ap.add_argument(
+        '-l', '--lexicon-only', action='store_true',
+        help='do not download anything, only recreate the binary lexicon '
+             'from the existing DB')
     quiet_option(ap)
     args = ap.parse_args()
     setup_logging(args.quiet)
-    update()
+    if args.lexicon_only:
+        update_lexicon()
+    else:
+        update()
 
 
 def update():
     '''
-    Update the 1-gram DB (a gzipped TSV file).
+    Update the 1-gram DB (a gzipped TSV file) and the binary lexicon.
     '''
     year_threshold = settings.gen_voc_year_threshold
     total_count = get_total_count(year_threshold)
     abs_threshold = total_count * settings.gen_voc_occ_threshold
     dest = settings.gen_voc_db_file
 
+    entries = []
     with gzip.open(dest, 'wt', encoding='utf8') as f:
         writer = csv.writer(f, dialect=TSVDialect)
         for ngram, occ in uniq(iterfetch(), year_threshold, abs_threshold):
@@ -61,6 +70,18 @@ def update():
             else:
                 pos = ''
             writer.writerow((ngram, pos, freq))
+            entries.append((ngram, freq))
+    lexicon.write(entries, settings.gen_voc_lexicon_file)
+
+
+def update_lexicon():
+    '''
+    Recreate the binary lexicon from the 1-gram DB.
+    '''
+    with gzip.open(settings.gen_voc_db_file, 'rt', encoding='utf8') as f:
+        rows = csv.reader(f, dialect=TSVDialect)
+        entries = [(ngram, float(freq)) for ngram, _, freq in rows]
+    lexicon.write(entries, settings.gen_voc_lexicon_file)
 
 
 def uniq(entries, year_threshold, occ_threshold):
@@ -11,9 +11,15 @@ Check for changes to the remote resources and update the dumps.
 
 import os
 import io
+import sys
 import time
+import shutil
+import hashlib
 import argparse
 import logging
+import http.client
+import urllib.error
+import urllib.parse
 import urllib.request
 import itertools as it
 import gzip
@@ -21,11 +27,16 @@ import tarfile
 import zipfile
 import tempfile
 import contextlib
-from collections import OrderedDict
+import multiprocessing as mp
+import concurrent.futures as cf
+from collections import OrderedDict, namedtuple
 
 from ..core import settings
+from ..core.rowcache import RowCache
+from ..core.aggregate import update_cross_index
 from ..inputfilters import FILTERS
-from ..lib.tools import quiet_option, setup_logging
+from ..lib.tools import quiet_option, setup_logging, locked, shared_pool
+from ..lib.prefetch import prefetch
 
 
 def main():
@@ -42,37 +53,195 @@ def main():
     ap.add_argument(
         '-f', '--force', action='store_true',
         help='force a new download, even if up-to-date')
+    ap.add_argument(
+        '-j', '--jobs', type=int, metavar='N', default=1,
+        help='update up to N resources in parallel processes')
+    ap.add_argument(
+        '-s', '--stage', action='store_true', default=None,
+        help='save downloads to disk before processing them, '
+             'resuming interrupted transfers (default: {})'
+             .format(settings.stage_downloads))
+    ap.add_argument(
+        '-t', '--threaded', action='store_true', default=None,
+        help='run each processing step in a separate thread '
+             '(default: {})'.format(settings.threaded_pipelines))
+    ap.add_argument(
+        '-c', '--compile-only', action='store_true',
+        help='do not download anything, only recreate derived files '
+             '(eg. compact dumps) from the existing dumps')
     quiet_option(ap)
     args = ap.parse_args()
     if 'all' in args.resources:
         args.resources = sorted(FILTERS)
     setup_logging(args.quiet)
-    fetch(args.resources, args.force)
+    if args.compile_only:
+        for name in args.resources:
+            logging.info('Compiling %s ...', name)
+            FILTERS[name].compile_dumps()
+            update_cross_index(name)
+    else:
+        failed = fetch(args.resources, args.force, args.jobs, args.stage,
+                       args.threaded)
+        if failed:
+            sys.exit(1)
 
 
-def fetch(which=FILTERS.keys(), force=False):
+def fetch(which=FILTERS.keys(), force=False, jobs=1, stage=None,
+          threaded=None):
     '''
     Determine remote updates and download changed resources.
+
+    With jobs > 1, the resources are updated in parallel
+    processes, with at most `settings.max_downloads_per_host`
+    simultaneous downloads from the same host.
+    A failing resource doesn't stop the others.
+    If `stage` is given, it overrides `settings.stage_downloads`,
+    and likewise `threaded` for `settings.threaded_pipelines`.
+    With `force`, the resources are downloaded unconditionally
+    (without checking for changes, see RemoteChecker.update()).
+    Return the names of the failed resources.
+    '''
+    which = list(which)
+    if not force:
+        which, failed = _select_changed(which)
+    else:
+        failed = []
+    if jobs > 1:
+        limits = {host: mp.BoundedSemaphore(settings.max_downloads_per_host)
+                  for host in _hosts(which)}
+        with mp.Pool(jobs, _init_worker, (limits,)) as pool:
+            outcomes = pool.starmap(_fetch_one,
+                                    [(name, False, stage, force, threaded)
+                                     for name in which],
+                                    chunksize=1)
+        # Build the cross-lookup indices only now, so that they are
+        # based on the final state of all updated dumps.
+        # Resources with unchanged content don't need a rebuild.
+        for name, outcome in zip(which, outcomes):
+            if outcome == 'updated':
+                update_cross_index(name)
+    else:
+        outcomes = [_fetch_one(name, True, stage, force, threaded)
+                    for name in which]
+    failed.extend(name for name, outcome in zip(which, outcomes)
+                  if outcome == 'failed')
+    if failed:
+        logging.error('Update failed for: %s', ', '.join(failed))
+    return failed
+
+
+def _select_changed(which):
+    '''
+    Check all resources for remote changes at once.
+
+    Return the names of the changed resources and of
+    those that couldn't be checked.
     '''
+    candidates = []
     for name in which:
         remote = RemoteChecker(name)
-        if not force and remote.sufficiently_recent():
+        if remote.sufficiently_recent():
             logging.info('Skipping %s (recent update)', name)
-        elif force or remote.has_changed():
-            logging.info('Updating %s ...', name)
-            remote.update()
         else:
-            logging.info('No change for %s', name)
+            candidates.append(remote)
+    changed, failed = [], []
+    for remote, answer in zip(candidates, check_all(candidates)):
+        if answer is None:
+            failed.append(remote.name)
+        elif answer:
+            changed.append(remote.name)
+        else:
+            logging.info('No change for %s', remote.name)
+    return changed, failed
+
+
+def _fetch_one(name, cross_index=True, stage=None, force=False,
+               threaded=None):
+    try:
+        logging.info('Updating %s ...', name)
+        remote = RemoteChecker(name, stage=stage, threaded=threaded)
+        replaced = remote.update(cross_index=cross_index,
+                                 conditional=not force)
+    except Exception:
+        logging.exception('Updating %s failed', name)
+        return 'failed'
+    return 'updated' if replaced else 'unchanged'
+
+
+def check_all(remotes, check_interval=settings.min_check_freq,
+              timeout=settings.check_timeout):
+    '''
+    Run has_changed() for many RemoteChecker objects concurrently.
+
+    All remote addresses are probed in a thread pool, with
+    a single timeout for the whole batch.
+    Return a list of booleans, with None for resources that
+    could not be checked (errors or timeout).
+    '''
+    answers = [r.cached_status(check_interval) for r in remotes]
+    pending = [(i, address)
+               for i, r in enumerate(remotes) if answers[i] is None
+               for address, *_ in r.resource.update_info()]
+    if not pending:
+        return answers
+    executor = cf.ThreadPoolExecutor(settings.check_threads)
+    try:
+        futures = {executor.submit(RemoteChecker._remote_head, address):
+                   (i, address)
+                   for i, address in pending}
+        done, _ = cf.wait(futures, timeout=timeout)
+    finally:
+        # Don't wait for any hanging requests.
+        executor.shutdown(wait=False)
+    if len(done) < len(futures):
+        logging.warning('Remote check timed out for %d address(es)',
+                        len(futures)-len(done))
+    incomplete = set()
+    for future, (i, address) in futures.items():
+        if future not in done or future.exception() is not None:
+            incomplete.add(i)
+        elif remotes[i].stat.differs(address, future.result()):
+            answers[i] = True
+    for i in sorted(set(i for i, _ in pending)):
+        if answers[i] is None and i not in incomplete:
+            answers[i] = False
+        if answers[i] is not None:
+            remotes[i].record_check(answers[i])
+    return answers
+
+
+def _hosts(which):
+    hosts = set()
+    for name in which:
+        for address, *_ in FILTERS[name].update_info():
+            hosts.add(urllib.parse.urlsplit(address).hostname)
+    return hosts
+
+
+# Per-host download semaphores (set in fetch worker processes).
+_host_limits = {}
+
+
+def _init_worker(limits):
+    global _host_limits
+    _host_limits = limits
 
 
 class RemoteChecker:
     '''Checking and updating for one specific resource.'''
-    def __init__(self, name, resource=None):
+    def __init__(self, name, resource=None, stage=None, threaded=None):
         if resource is None:
             resource = FILTERS[name]
+        if stage is None:
+            stage = settings.stage_downloads
+        if threaded is None:
+            threaded = settings.threaded_pipelines
         self.name = name
         self.resource = resource
         self.stat = StatLog(name, resource)
+        self.stage = stage
+        self.pipeline = ThreadedPipeline if threaded else Pipeline
+        self._staged = {}
 
     def last_check(self):
         '''
@@ -92,9 +261,30 @@ class RemoteChecker:
 
     def has_changed(self, check_interval=settings.min_check_freq):
         '''
-        Check if the size of the remote resource has changed.
+        Check if the remote resource has changed.
+
+        The size and the ETag/Last-Modified headers (if
+        available) are compared to those of the last download.
+        '''
+        answer = self.cached_status(check_interval)
+        if answer is not None:
+            return answer
+
+        # Check remotely.
+        answer = False
+        for address, *_ in self.resource.update_info():
+            if self.stat.differs(address, self._remote_head(address)):
+                answer = True
+                break
+        self.record_check(answer)
+        return answer
+
+    def cached_status(self, check_interval=settings.min_check_freq):
+        '''
+        Answer has_changed() without a remote check, if possible.
+
+        Return None if a remote check is needed.
         '''
-        # Check cached values.
         if self.stat.has_changed:
             # No need to check again: We don't expect the remote to roll back
             # changes.
@@ -109,39 +299,35 @@ class RemoteChecker:
         except TypeError:
             # Has never been checked before.
             pass
+        return None
 
-        # Check remotely.
-        answer = False
-        for address, *_ in self.resource.update_info():
-            previous_size = self.stat.sizes.get(address)
-            current_size = self._content_size(address)
-            if current_size != previous_size:
-                answer = True
-                break
+    def record_check(self, answer):
+        '''
+        Store the outcome of a remote check.
+        '''
         try:
             self.stat.just_checked(answer)
         except ValueError:
             # The resource has never been downloaded.
             pass
-        return answer
 
     @staticmethod
-    def _content_size(address):
+    def _remote_head(address):
         try:
             req = urllib.request.Request(address, method='HEAD')
-            resp = urllib.request.urlopen(req)
-            size = int(resp.headers.get('content-length'))
+            resp = urllib.request.urlopen(req, timeout=settings.timeout)
+            stat = RemoteStat.from_headers(resp.headers)
         except Exception:
-            logging.exception('Remote size check failed.')
+            logging.exception('Remote check failed.')
             raise
         finally:
             try:
                 resp.close()
             except NameError:
                 pass
-        return size
+        return stat
 
-    def update(self, wait=False):
+    def update(self, wait=False, cross_index=True, conditional=True):
         '''
         Replace all resource dumps belonging to this resource.
 
@@ -149,18 +335,52 @@ class RemoteChecker:
         If `wait` is False (the default), an exception is raised.
         Otherwise, the call blocks until the concurrent process
         has ended, then exits with a warning.
+        If `cross_index` is False, the caller is responsible for
+        updating the cross-lookup indices.
+        If `conditional` is True (the default), the download is
+        skipped if the remote content is the same as last time
+        (see _unchanged()); only the `modified` time is updated
+        then, the dumps (and everything derived from them, like
+        cached rows) remain valid.
+        Return True if the dumps were replaced, False otherwise
+        (unchanged remote, or waited for a concurrent update).
         '''
         if self.stat.concurrent_update():
             if wait:
                 self._wait_concurrent()
-                return
+                return False
             else:
                 raise RuntimeError('Concurrent update in progress')
 
-        for address, *steps in self.resource.update_info():
-            size = self._download(address, steps)
-            self.stat.sizes[address] = size
+        pipelines = self.resource.update_info()
+        if conditional and self._unchanged([a for a, *_ in pipelines]):
+            logging.info('Remote content unchanged for %s', self.name)
+            for address, (path, stat) in self._staged.items():
+                os.remove(path)
+                self.stat.remotes[address] = stat
+            self._staged.clear()
+            self.stat.just_modified()
+            return False
+        if self.resource.concurrent_remotes and len(pipelines) > 1:
+            # Any preprocessing workers are shared by the pipelines
+            # and started before the threads.
+            with shared_pool(settings.preprocess_workers), \
+                    cf.ThreadPoolExecutor(len(pipelines)) as executor:
+                futures = [executor.submit(self._download, address, steps)
+                           for address, *steps in pipelines]
+            stats = [f.result() for f in futures]
+        else:
+            stats = [self._download(address, steps)
+                     for address, *steps in pipelines]
+        for (address, *_), stat in zip(pipelines, stats):
+            self.stat.remotes[address] = stat
+        self.resource.compile_dumps()
+        if cross_index:
+            update_cross_index(self.name)
         self.stat.just_modified()
+        # Cached rows of the old dumps are now obsolete.
+        RowCache().invalidate(self.name)
+        return True
 
     def _wait_concurrent(self):
         logging.warning('Waiting for a concurrent update.')
@@ -173,18 +393,257 @@ class RemoteChecker:
             time.sleep(next(interval))
         logging.warning('Concurrent update has ended.')
 
+    def _unchanged(self, addresses):
+        '''
+        Check if the remote content is the same as last time.
+
+        Each address is requested with a conditional GET
+        (If-None-Match/If-Modified-Since).
+        Without staging, any other answer than "304 Not Modified"
+        counts as a change.
+        With staging, a modified response is downloaded and
+        compared to the SHA-256 of the last download; the staged
+        files are kept for the actual update.
+        All addresses of a resource must be unchanged, since
+        their pipelines can depend on each other.
+        '''
+        if not all(os.path.exists(fn) for fn in self.resource.dump_fns()):
+            return False
+        for address in addresses:
+            known = self.stat.remotes.get(address)
+            if known is None:
+                return False
+            if self.stage:
+                staged = self._stage(address, known)
+                if staged is not None:
+                    self._staged[address] = staged
+                    if staged[1].sha256 != known.sha256:
+                        return False
+            elif not known.conditions() or not self._not_modified(address,
+                                                                  known):
+                return False
+        return True
+
     @staticmethod
-    def _download(address, steps):
+    def _not_modified(address, known):
+        req = urllib.request.Request(address, headers=known.conditions())
+        limit = _host_limits.get(urllib.parse.urlsplit(address).hostname)
+        with limit or contextlib.suppress():  # (no limit: dummy context)
+            try:
+                # Close immediately: the payload is downloaded later.
+                with urllib.request.urlopen(req, timeout=settings.timeout):
+                    return False
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    return True
+                logging.exception('Remote check failed.')
+                raise
+
+    def _download(self, address, steps):
+        if self.stage:
+            return self._staged_download(address, steps)
+        limit = _host_limits.get(urllib.parse.urlsplit(address).hostname)
+        with limit or contextlib.suppress():  # (no limit: dummy context)
+            try:
+                with urllib.request.urlopen(address,
+                                            timeout=settings.timeout) as r:
+                    payload = _HashingReader(r)
+                    self.pipeline.run(io.BufferedReader(payload, 2**20),
+                                      *steps)
+                    # Hash anything that the pipeline didn't consume.
+                    payload.drain()
+                    stat = RemoteStat.from_headers(r.headers,
+                                                   sha256=payload.hexdigest())
+            except Exception:
+                logging.exception('Download failed')
+                raise
+        return stat
+
+    def _staged_download(self, address, steps):
+        path, stat = self._staged.pop(address, None) or self._stage(address)
+        # Process from disk (outside the download limit).
+        with open(path, 'rb') as f:
+            self.pipeline.run(f, *steps)
+        os.remove(path)
+        return stat
+
+    @staticmethod
+    def _stage(address, known=None):
+        limit = _host_limits.get(urllib.parse.urlsplit(address).hostname)
+        with limit or contextlib.suppress():  # (no limit: dummy context)
+            return Stager(address, known).fetch()
+
+
+class _HashingReader(io.RawIOBase):
+    '''
+    Raw reader that computes the SHA-256 of the data read.
+    '''
+    def __init__(self, raw):
+        super().__init__()
+        self._raw = raw
+        self._hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._raw.readinto(b)
+        if n:
+            self._hash.update(memoryview(b)[:n])
+        return n
+
+    def drain(self):
+        '''Read (and hash) the remaining data.'''
+        for chunk in iter(lambda: self._raw.read(2**20), b''):
+            self._hash.update(chunk)
+
+    def hexdigest(self):
+        '''Hash of all data read so far.'''
+        return self._hash.hexdigest()
+
+
+class Stager:
+    '''
+    Download a remote file to the staging directory.
+
+    The payload is written to a ".part" file first.
+    If the transfer is interrupted, it is resumed with an
+    HTTP range request, using the ETag or Last-Modified
+    value of the first response as "If-Range" condition
+    (if the remote has changed meanwhile, the server sends
+    the complete file instead).
+    If `known` (a RemoteStat) is given, a new transfer is
+    made conditional on the remote having been modified.
+    Concurrent processes staging the same address wait
+    for each other (file lock).
+    '''
+    def __init__(self, address, known=None):
+        self.address = address
+        self.known = known
+        name = os.path.basename(urllib.parse.urlsplit(address).path)
+        digest = hashlib.sha1(address.encode('utf8')).hexdigest()[:12]
+        base = os.path.join(settings.path_staging,
+                            '{}-{}'.format(digest, name))
+        self.part = base + '.part'
+        self.validator = self.part + '.validator'
+        self.lock = base + '.lock'
+        # The completed download is private to this process, such that
+        # a concurrent update can't replace or remove it before use.
+        self.path = '{}.{}'.format(base, os.getpid())
+
+    def fetch(self):
+        '''
+        Download (or complete) the file.
+
+        Return the local path and a RemoteStat, or None if
+        the remote was not modified.
+        '''
+        os.makedirs(settings.path_staging, exist_ok=True)
+        with locked(self.lock, 'ab'):
+            return self._fetch()
+
+    def _fetch(self):
+        wait = settings.download_retry_wait
+        for attempt in it.count():
+            try:
+                size, headers = self._transfer()
+                break
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    return None
+                if e.code == 416 and self._complete(e.headers):
+                    size = os.path.getsize(self.part)
+                    headers = self._restore_validator(e.headers)
+                    break
+                if e.code < 500 or attempt >= settings.download_retries:
+                    logging.exception('Download failed')
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                if attempt >= settings.download_retries:
+                    logging.exception('Download failed')
+                    raise
+                error = e
+            logging.warning('Download of %s interrupted, resuming in %ds',
+                            self.address, wait, exc_info=error)
+            time.sleep(wait)
+            wait *= 2
+        os.rename(self.part, self.path)
+        self._remove(self.validator)
+        return self.path, RemoteStat.from_headers(
+            headers, size=size, sha256=self._hash())
+
+    def _transfer(self):
+        req = urllib.request.Request(self.address)
+        offset = self._resumable()
+        if offset:
+            req.add_header('Range', 'bytes={}-'.format(offset))
+            with open(self.validator, encoding='utf8') as f:
+                req.add_header('If-Range', f.read())
+        elif self.known is not None:
+            for header, value in self.known.conditions().items():
+                req.add_header(header, value)
+        with urllib.request.urlopen(req, timeout=settings.timeout) as r:
+            if r.getcode() != 206:
+                # Complete file (no range support, or changed remote).
+                offset = 0
+            size = offset + int(r.headers.get('content-length'))
+            self._save_validator(r.headers)
+            with open(self.part, 'ab' if offset else 'wb') as f:
+                shutil.copyfileobj(r, f, 2**20)
+        if os.path.getsize(self.part) != size:
+            raise http.client.IncompleteRead(b'', size)
+        return size, r.headers
+
+    def _hash(self):
+        sha = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _resumable(self):
+        '''Size of a partial download that can be resumed.'''
+        if not os.path.exists(self.validator):
+            return 0
         try:
-            r = urllib.request.urlopen(address, timeout=settings.timeout)
-            size = int(r.headers.get('content-length'))
-            Pipeline.run(r, *steps)
-        except Exception:
-            logging.exception('Download failed')
-            raise
-        finally:
-            r.close()
-        return size
+            return os.path.getsize(self.part)
+        except FileNotFoundError:
+            return 0
+
+    def _save_validator(self, headers):
+        validator = headers.get('ETag') or headers.get('Last-Modified')
+        if validator is None:
+            # Resuming is not safe without a validator.
+            self._remove(self.validator)
+        else:
+            with open(self.validator, 'w', encoding='utf8') as f:
+                f.write(validator)
+
+    def _restore_validator(self, headers):
+        '''Add the saved validator if the headers lack one.'''
+        if headers.get('ETag') or headers.get('Last-Modified'):
+            return headers
+        with open(self.validator, encoding='utf8') as f:
+            validator = f.read()
+        headers = dict(headers.items())
+        # ETags are quoted, dates aren't.
+        headers['ETag' if validator.endswith('"') else 'Last-Modified'] = \
+            validator
+        return headers
+
+    def _complete(self, headers):
+        '''Does a 416 response mean that the file is already complete?'''
+        # Content-Range: bytes */<total size>
+        total = (headers.get('Content-Range') or '').rpartition('/')[2]
+        return total.isdigit() and int(total) == os.path.getsize(self.part)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
 
 class Pipeline:
@@ -244,8 +703,15 @@ class Pipeline:
     def tar(cls, stream, steps):
         '''
         Unpack a tar archive.
+
+        If the branches need merging and the archive is a
+        local file, the members are read side by side
+        instead of buffering all but the last one.
         '''
         forking = Forking(*steps)
+        if forking.concurrent and _local_file(stream):
+            cls._tar_concurrent(stream, forking)
+            return
         with tarfile.open(fileobj=stream, mode='r|*') as t:
             for info in iter(t.next, None):
                 if info.name in forking.targets:
@@ -254,6 +720,25 @@ class Pipeline:
                         cls._pipe(f, *branch_steps)
                         f.close()
 
+    @classmethod
+    def _tar_concurrent(cls, stream, forking):
+        with contextlib.ExitStack() as stack:
+            members = []
+            for name in forking.targets:
+                # Each member gets its own reader on the archive file.
+                view = stack.enter_context(io.BufferedReader(
+                    _FileView(stream.fileno(), stream.tell()), 2**20))
+                t = stack.enter_context(
+                    tarfile.open(fileobj=view, mode='r|*'))
+                f = _extract_member(t, name)
+                members.append(stack.enter_context(cls._read_ahead(f)))
+            cls._pipe(members, *forking.merged_steps)
+
+    @staticmethod
+    def _read_ahead(stream):
+        # Hook for reading concurrent branches in the background.
+        return contextlib.closing(stream)
+
     @classmethod
     def zip(cls, stream, steps):
         '''
@@ -267,6 +752,32 @@ class Pipeline:
                     cls._pipe(z.open(member), *branch_steps)
 
 
+class ThreadedPipeline(Pipeline):
+    '''
+    Pipeline with a separate thread for each step.
+
+    The output of every step is read ahead in a background
+    thread and passed on through a bounded queue, such that
+    network reads, decompression, parsing and writing can
+    overlap (as far as the GIL permits: I/O and zlib release
+    it, pure-Python preprocessing doesn't).
+    '''
+    @classmethod
+    def _pipe(cls, stream, *steps):
+        if _local_file(stream):
+            # No need to read ahead from disk; also, the tar step
+            # can read concurrent branches from a local archive.
+            super()._pipe(stream, *steps)
+            return
+        with prefetch(stream, settings.pipeline_queue_size) as stream:
+            super()._pipe(stream, *steps)
+
+    @staticmethod
+    def _read_ahead(stream):
+        # Decompress each branch in its own thread.
+        return prefetch(stream, settings.pipeline_queue_size)
+
+
 class Forking:
     '''
     Resolve a forking in the steps sequence.
@@ -294,6 +805,11 @@ class Forking:
         'Extraction targets (archive member names).'
         return self.branches.keys()
 
+    @property
+    def concurrent(self):
+        'Can the branches be read side by side into the merge?'
+        return bool(self.merged_steps) and not any(self.branches.values())
+
     @contextlib.contextmanager
     def fork(self, name):
         '''
@@ -330,6 +846,43 @@ class Forking:
             # Do nothing on exit.
 
 
+def _local_file(stream):
+    # Is this a regular file opened from disk?
+    raw = getattr(stream, 'raw', stream)
+    return isinstance(raw, io.FileIO) and raw.seekable()
+
+
+def _extract_member(archive, name):
+    for info in iter(archive.next, None):
+        if info.name == name:
+            return archive.extractfile(info)
+    raise KeyError('archive member not found: {}'.format(name))
+
+
+class _FileView(io.RawIOBase):
+    '''
+    Independent reader for an open file.
+
+    The data are read with os.pread, which doesn't move
+    the file position, so multiple views can be read
+    at the same time.
+    '''
+    def __init__(self, fileno, offset=0):
+        super().__init__()
+        self._fileno = fileno
+        self._offset = offset
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = os.pread(self._fileno, len(b), self._offset)
+        n = len(data)
+        b[:n] = data
+        self._offset += n
+        return n
+
+
 class LazyZipFile:
     '''
     Lazy wrapper around ZipFile.
@@ -337,16 +890,26 @@ class LazyZipFile:
     This is mainly needed to allow establishing the entire
     pipeline before waiting for all the zip-file data to
     be downloaded.
+    Unseekable streams are copied to a temp file, which
+    is kept in memory up to `settings.tempfile_buffer_size`.
     '''
     def __init__(self, stream):
         self._stream = stream
+        self._spool = None
         self._archive = None
 
     @property
     def archive(self):
         '''Download and open the archive, if necessary.'''
         if self._archive is None:
-            self._archive = zipfile.ZipFile(io.BytesIO(self._stream.read()))
+            stream = self._stream
+            if not getattr(stream, 'seekable', lambda: False)():
+                self._spool = tempfile.SpooledTemporaryFile(
+                    max_size=settings.tempfile_buffer_size)
+                shutil.copyfileobj(stream, self._spool, 2**20)
+                self._spool.seek(0)
+                stream = self._spool
+            self._archive = zipfile.ZipFile(stream)
         return self._archive
 
     def open(self, member):
@@ -359,10 +922,46 @@ class LazyZipFile:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self._archive is not None:
-            return self._archive.__exit__(exc_type, exc_val, exc_tb)
+            self._archive.close()
+        if self._spool is not None:
+            self._spool.close()
         return False  # don't suppress exceptions
 
 
+class RemoteStat(namedtuple('RemoteStat',
+                            'size etag last_modified sha256')):
+    '''
+    Properties of a remote file, as seen at download time.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_headers(cls, headers, size=None, sha256=None):
+        '''Create an instance from HTTP response headers.'''
+        if size is None:
+            size = int(headers.get('content-length'))
+        return cls(size, headers.get('ETag'), headers.get('Last-Modified'),
+                   sha256)
+
+    def differs(self, other):
+        '''Do the properties of `other` indicate a change?'''
+        if self.size != other.size:
+            return True
+        # Compare validators only if both sides have them.
+        return any(a is not None and b is not None and a != b
+                   for a, b in ((self.etag, other.etag),
+                                (self.last_modified, other.last_modified)))
+
+    def conditions(self):
+        '''Headers for a conditional GET.'''
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
 class StatLog:
     '''Cached reading/writing of the dump stat log.'''
     def __init__(self, name, resource):
@@ -370,7 +969,7 @@ class StatLog:
                                    '{}.log'.format(name))
         self._dumpfns = resource.dump_fns()
 
-        self.sizes = {}
+        self.remotes = {}
         self.modified = None
         self.checked = None
         self.has_changed = None
@@ -383,12 +982,16 @@ class StatLog:
             with open(self._logfn) as f:
                 modified, checked, changed = [int(n) for n in next(f).split()]
                 for line in f:
-                    fn, size = line.rsplit(maxsplit=1)
+                    address, *fields = line.rstrip('\n').split('\t')
+                    # Older logs have only the size.
+                    fields += [''] * (len(RemoteStat._fields)-len(fields))
+                    size, *fields = [v or None for v in fields]
                     try:
-                        self.sizes[fn] = int(size)
-                    except ValueError:
+                        size = int(size)
+                    except (TypeError, ValueError):
                         # No size yet (parsed "None").
-                        pass
+                        continue
+                    self.remotes[address] = RemoteStat(size, *fields)
         except FileNotFoundError:
             modified = checked = self._init_time()
             # If the resource is not present yet (modified is None),
@@ -428,10 +1031,20 @@ class StatLog:
         with open(self._logfn + '.tmp', 'w') as f:
             f.write('{}\t{}\t{:d}\n'
                     .format(self.modified, self.checked, self.has_changed))
-            for fn, size in self.sizes.items():
-                f.write('{}\t{}\n'.format(fn, size))
+            for address, stat in self.remotes.items():
+                fields = ('' if v is None else v for v in stat)
+                f.write('\t'.join((address, *map(str, fields))) + '\n')
         os.rename(self._logfn + '.tmp', self._logfn)
 
+    def differs(self, address, current):
+        '''
+        Has the remote file changed since the last download?
+
+        `current` is a RemoteStat from a HEAD request.
+        '''
+        known = self.remotes.get(address)
+        return known is None or known.differs(current)
+
     def concurrent_update(self):
         'Check if another process is currently updating.'
         for fn in self._dumpfns:
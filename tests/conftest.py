@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Shared fixtures.
+'''
+
+
+import threading
+import http.server
+
+import pytest
+
+
+@pytest.fixture
+def serve():
+    '''
+    Start a local HTTP server.
+
+    The returned function takes a callback, which is called
+    with the request handler for every GET and HEAD request,
+    and returns the base URL of the server.
+    '''
+    servers = []
+    def _serve(respond):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                respond(self)
+            do_HEAD = do_GET
+            def log_message(self, *args):
+                pass
+        srv = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return 'http://127.0.0.1:{}'.format(srv.server_port)
+    yield _serve
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
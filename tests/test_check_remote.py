@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Check remote checks and download limits against a local server.
+'''
+
+
+import time
+import threading
+import concurrent.futures as cf
+
+import pytest
+
+from bth.core import settings
+from bth.update import fetch_remote
+
+
+class _Resource:
+    def __init__(self, address):
+        self.address = address
+
+    def update_info(self):
+        return [(self.address, 'dump.tsv')]
+
+    @staticmethod
+    def dump_fns():
+        return ['missing.tsv']
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'path_update_logs', str(tmp_path/'logs'))
+    monkeypatch.setattr(settings, 'path_staging', str(tmp_path/'staging'))
+    return tmp_path/'logs'
+
+
+def _checker(log_dir, name, address, etag):
+    '''A RemoteChecker whose last download saw `etag`.'''
+    log_dir.mkdir(exist_ok=True)
+    with open(str(log_dir/'{}.log'.format(name)), 'w') as f:
+        f.write('1000\t1000\t0\n{}\t10\t{}\t\t\n'.format(address, etag))
+    return fetch_remote.RemoteChecker(name, _Resource(address))
+
+
+def test_check_all(serve, log_dir):
+    requests = []
+    def respond(handler):
+        requests.append((handler.command, handler.path))
+        if handler.path == '/missing':
+            handler.send_response(404)
+        else:
+            handler.send_response(200)
+            handler.send_header('ETag', '"{}"'.format(handler.path[1:]))
+        handler.send_header('Content-Length', '10')
+        handler.end_headers()
+    url = serve(respond)
+    remotes = [_checker(log_dir, 'same', url+'/a', '"a"'),
+               _checker(log_dir, 'changed', url+'/b', '"a"'),
+               _checker(log_dir, 'missing', url+'/missing', '"a"')]
+    answers = fetch_remote.check_all(remotes, check_interval=0, timeout=10)
+    assert answers == [False, True, None]
+    assert sorted(requests) == [('HEAD', '/a'), ('HEAD', '/b'),
+                                ('HEAD', '/missing')]
+    # The outcome is logged, except for the failed check.
+    assert [r.stat.checked > 1000 for r in remotes] == [True, True, False]
+    reloaded = fetch_remote.RemoteChecker('changed', _Resource(url+'/b'))
+    assert reloaded.cached_status() is True
+
+
+def test_check_all_timeout(serve, log_dir):
+    def respond(handler):
+        if handler.path == '/slow':
+            time.sleep(1)
+        handler.send_response(200)
+        handler.send_header('ETag', '"a"')
+        handler.send_header('Content-Length', '10')
+        handler.end_headers()
+    url = serve(respond)
+    remotes = [_checker(log_dir, 'fast', url+'/fast', '"a"'),
+               _checker(log_dir, 'slow', url+'/slow', '"a"')]
+    answers = fetch_remote.check_all(remotes, check_interval=0, timeout=.3)
+    assert answers == [False, None]
+
+
+def test_host_limit(serve, log_dir, monkeypatch):
+    lock = threading.Lock()
+    active, peak = [0], [0]
+    def respond(handler):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(.2)
+        with lock:
+            active[0] -= 1
+        handler.send_response(200)
+        handler.send_header('Content-Length', '4')
+        handler.end_headers()
+        handler.wfile.write(b'data')
+    url = serve(respond)
+    monkeypatch.setattr(fetch_remote, '_host_limits',
+                        {'127.0.0.1': threading.BoundedSemaphore(2)})
+    with cf.ThreadPoolExecutor(6) as executor:
+        results = list(executor.map(fetch_remote.RemoteChecker._stage,
+                                    ['{}/f{}'.format(url, i)
+                                     for i in range(6)]))
+    assert peak[0] == 2
+    for path, stat in results:
+        with open(path, 'rb') as f:
+            assert f.read() == b'data'
+        assert stat.size == 4
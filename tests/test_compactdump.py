@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Compare reading from compact dumps with the TSV fallback.
+'''
+
+
+import os
+
+import pytest
+
+from bth.core import settings
+from bth.lib import compactdump
+from bth.inputfilters.ncbitax import RecordSet
+
+
+RANKS = ('species', 'genus', 'no rank', 'strain')
+
+
+@pytest.fixture
+def dump_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'path_dumps', str(tmp_path))
+    # Interleaved ranks, with runs of different lengths
+    # and more rows than a single block.
+    with open(str(tmp_path / RecordSet.dump_fn), 'w', encoding='utf-8') as f:
+        for i in range(2*compactdump.BLOCK_SIZE + 500):
+            rank = RANKS[(i*i // 7) % len(RANKS)]
+            f.write('{0}\tCUI-less\t{1}\tname {0}\tname {0}\tsyn {0}\n'
+                    .format(i, rank))
+    return tmp_path
+
+
+def _rows(ranks):
+    return [tuple(row)
+            for batch in RecordSet(ranks=ranks).iter_batches()
+            for row in batch.tuples()]
+
+
+@pytest.mark.parametrize('ranks', [
+    'species',
+    'all',
+    ['species', 'genus'],
+    ['no rank', 'strain', 'species'],
+])
+def test_compact_matches_tsv(dump_dir, ranks):
+    expected = _rows(ranks)
+    assert expected
+
+    RecordSet.compile_dumps()
+    bin_fn = compactdump.path_for(os.path.join(str(dump_dir),
+                                               RecordSet.dump_fn))
+    assert compactdump.is_fresh(bin_fn, RecordSet().fn)
+
+    assert _rows(ranks) == expected
+
+
+def test_outdated_format_is_stale(dump_dir):
+    expected = _rows('species')
+    RecordSet.compile_dumps()
+    bin_fn = compactdump.path_for(RecordSet().fn)
+    with open(bin_fn, 'r+b') as f:
+        f.write(b'BTHdump0')
+    assert not compactdump.is_fresh(bin_fn, RecordSet().fn)
+
+    assert _rows('species') == expected
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Check the row-adding postfilters.
+'''
+
+
+from bth.lib import postfilters
+from bth.lib.tools import Fields, RowBatch
+
+
+ROWS = [
+    Fields('C1', 'CTD (MESH)', 'D1', 'Parkinson disease', 'PD', 'disease'),
+    Fields('C2', 'EntrezGene', '5', 'Parkinson disease', 'PD', 'gene'),
+]
+
+
+def test_lookup_adder_accepts_iterator():
+    adder = postfilters.LookupReplaceAdder(
+        {'Parkinson disease': 'Parkinson'}, iter(['CTD (MESH)']))
+    expected = [ROWS[0], ROWS[0]._replace(term='Parkinson'), ROWS[1]]
+    assert list(adder(ROWS)) == expected
+    chunk = adder.filter_chunk(RowBatch.from_rows(ROWS))
+    assert list(chunk) == expected
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Check how web requests are turned into aggregation jobs.
+'''
+
+
+import pytest
+from bottle import FormsDict
+
+from bth.core import settings, aggregate
+from bth.lib.pairhash import PairHashSet
+from bth.server import server
+
+
+class _Started(Exception):
+    '''Stop the request handler once the job is submitted.'''
+
+
+@pytest.fixture
+def dump_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'path_dumps', str(tmp_path))
+    for name in ('ctd_chem', 'mesh'):
+        for fn in aggregate.FILTERS[name].dump_fns():
+            open(fn, 'w').close()
+    return tmp_path
+
+
+def _submit(**fields):
+    params = FormsDict()
+    for key, values in fields.items():
+        for value in values:
+            params.append(key, value)
+    jobs = []
+    def callback(job):
+        jobs.append(job)
+        raise _Started()
+    with pytest.raises(_Started):
+        server.termlist_request(params, callback)
+    rsc, *_ = jobs[0]
+    return rsc
+
+
+def _exclude_param(rsc, monkeypatch):
+    '''Get the "exclude" param passed to ctd_chem.'''
+    index = PairHashSet()
+    monkeypatch.setattr(aggregate, 'load_cross_index', lambda dup: index)
+    specs = {}
+    def instantiate(constr, params):
+        specs[constr] = params
+        return iter(())
+    rsc._instantiate = instantiate
+    rsc.cache = None
+    list(rsc.iter_batches(header=False))
+    exclude = specs[aggregate.FILTERS['ctd_chem']]['exclude']
+    return 'precomputed' if exclude is index else 'runtime'
+
+
+def test_web_job_uses_precomputed_index(dump_dir, monkeypatch):
+    rsc = _submit(resources=['ctd_chem'], flags=['ctd_lookup'])
+    assert _exclude_param(rsc, monkeypatch) == 'precomputed'
+
+
+@pytest.mark.parametrize('fields', [
+    {'idprefix': ['uri']},
+    {'resource-std': ['CTD'], 'resource-custom': ['ctd']},
+])
+def test_web_job_with_custom_params(dump_dir, monkeypatch, fields):
+    rsc = _submit(resources=['ctd_chem'], flags=['ctd_lookup'], **fields)
+    assert _exclude_param(rsc, monkeypatch) == 'runtime'
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+# Author: Lenz Furrer, 2019
+
+
+'''
+Check staged and streamed downloads against a local server.
+'''
+
+
+import os
+import hashlib
+
+import pytest
+
+from bth.core import settings
+from bth.update import fetch_remote
+from bth.update.fetch_remote import Stager, RemoteStat
+
+
+DATA = bytes(range(256)) * 1000
+ETAG = '"v1"'
+
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'path_staging', str(tmp_path/'staging'))
+    monkeypatch.setattr(settings, 'path_update_logs', str(tmp_path/'logs'))
+    monkeypatch.setattr(settings, 'download_retry_wait', 0)
+    monkeypatch.setattr(settings, 'download_retries', 2)
+    return tmp_path/'staging'
+
+
+def _server(serve, requests, drop_first=False):
+    '''
+    Serve DATA with range support.
+
+    With `drop_first`, the first response is cut off
+    after half of the body.
+    '''
+    def respond(handler):
+        headers = handler.headers
+        requests.append((headers.get('Range'), headers.get('If-Range'),
+                         headers.get('If-None-Match')))
+        if headers.get('If-None-Match') == ETAG:
+            handler.send_response(304)
+            handler.end_headers()
+            return
+        start = 0
+        if headers.get('Range') and headers.get('If-Range') == ETAG:
+            start = int(headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(DATA):
+                handler.send_response(416)
+                handler.send_header('Content-Range',
+                                    'bytes */{}'.format(len(DATA)))
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(DATA)-1, len(DATA)))
+        else:
+            handler.send_response(200)
+        handler.send_header('ETag', ETAG)
+        handler.send_header('Content-Length', str(len(DATA)-start))
+        handler.end_headers()
+        body = DATA[start:]
+        if drop_first and len(requests) == 1:
+            body = body[:len(body)//2]
+        handler.wfile.write(body)
+    return serve(respond) + '/data.bin'
+
+
+def _check(result):
+    path, stat = result
+    with open(path, 'rb') as f:
+        assert f.read() == DATA
+    assert stat.size == len(DATA)
+    assert stat.etag == ETAG
+    assert stat.sha256 == hashlib.sha256(DATA).hexdigest()
+    return path
+
+
+def _leftovers(staging, path):
+    '''Staging files other than the download and the lock.'''
+    return [fn for fn in os.listdir(str(staging))
+            if fn != os.path.basename(path) and not fn.endswith('.lock')]
+
+
+def test_resume(serve, staging):
+    requests = []
+    url = _server(serve, requests, drop_first=True)
+    path = _check(Stager(url).fetch())
+    half = len(DATA) // 2
+    assert requests == [(None, None, None),
+                        ('bytes={}-'.format(half), ETAG, None)]
+    assert _leftovers(staging, path) == []
+
+
+def test_changed_remote(serve, staging):
+    requests = []
+    url = _server(serve, requests)
+    stager = Stager(url)
+    # A partial download of an older version.
+    staging.mkdir()
+    with open(stager.part, 'wb') as f:
+        f.write(b'old data')
+    with open(stager.validator, 'w') as f:
+        f.write('"v0"')
+    _check(stager.fetch())
+    assert requests == [('bytes=8-', '"v0"', None)]
+
+
+def test_complete_part(serve, staging):
+    requests = []
+    url = _server(serve, requests)
+    stager = Stager(url)
+    # The transfer finished, but the process died before renaming.
+    staging.mkdir()
+    with open(stager.part, 'wb') as f:
+        f.write(DATA)
+    with open(stager.validator, 'w') as f:
+        f.write(ETAG)
+    # The 416 response has no ETag: the saved validator is used.
+    path = _check(stager.fetch())
+    assert requests == [('bytes={}-'.format(len(DATA)), ETAG, None)]
+    assert _leftovers(staging, path) == []
+
+
+def test_not_modified(serve, staging):
+    requests = []
+    url = _server(serve, requests)
+    known = RemoteStat(len(DATA), ETAG, None, None)
+    assert Stager(url, known).fetch() is None
+    assert requests == [(None, None, ETAG)]
+    changed = RemoteStat(len(DATA), '"v0"', None, None)
+    _check(Stager(url, changed).fetch())
+
+
+def test_drain(serve, staging):
+    '''Unconsumed data are still hashed in a streamed download.'''
+    url = _server(serve, [])
+    class Resource:
+        @staticmethod
+        def dump_fns():
+            return ['missing.tsv']
+    remote = fetch_remote.RemoteChecker('x', Resource(), stage=False,
+                                        threaded=False)
+    head = []
+    stat = remote._download(url, [lambda f: head.append(f.read(10))])
+    assert head == [DATA[:10]]
+    assert stat.sha256 == hashlib.sha256(DATA).hexdigest()